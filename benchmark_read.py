@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import time
+import argparse
+import uproot
+
+from datetime import datetime
+from lib.readoptions import ReadOptions
+from lib.memory import IMAGE_BRANCHES
+from lib.rootfile import RootFile
+
+pjoin = os.path.join
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_read_benchmark')
+    parser.add_argument('--numevents', type=int, help='Number of entries to read, the whole file by default.', default=None)
+    parser.add_argument('--threads', type=int, nargs='+', help='Thread counts to compare, by default 1, 2, 4, ... up to the number of cores.', default=None)
+    parser.add_argument('--repeat', type=int, help='Number of reads per thread count, the fastest one is kept.', default=3)
+    parser.add_argument('--rootfile', action='store_true', help='Also time the full RootFile construction and masking.')
+    args = parser.parse_args()
+    return args
+
+def get_thread_counts():
+    numCores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < numCores:
+        counts.append(counts[-1] * 2)
+    if numCores > 1:
+        counts.append(numCores)
+    return counts
+
+def time_read(func, repeat):
+    times = []
+    for _ in range(repeat):
+        starttime = time.time()
+        func()
+        times.append(time.time() - starttime)
+    return min(times)
+
+def main():
+    args = parse_cli()
+
+    tree = uproot.open(args.inpath)['Events']
+    numevents = tree.numentries if args.numevents is None else min(args.numevents, tree.numentries)
+    # Approximate size of the entries read, from the size of the whole branches
+    numBytes = sum(tree[name].uncompressedbytes() for name in IMAGE_BRANCHES) * numevents / max(tree.numentries, 1)
+
+    # Warm up the OS file cache, so that all thread counts read from memory
+    tree.arrays(IMAGE_BRANCHES, entrystop=numevents)
+
+    lines = [f'Read benchmark for {args.inpath}, {numevents} entries, {numBytes / 1024**2:.1f} MB of uncompressed image branches']
+    lines.append(f'{"threads":>8} {"images (s)":>11} {"MB/s":>8} {"speedup":>8}' + (f' {"RootFile (s)":>13} {"speedup":>8}' if args.rootfile else ''))
+
+    reference = {}
+    for numThreads in (args.threads or get_thread_counts()):
+        # No basket cache, every repetition decompresses all the baskets again
+        options = ReadOptions(numThreads=numThreads, basketCacheBytes=0)
+
+        results = [time_read(lambda: tree.arrays(IMAGE_BRANCHES, entrystop=numevents, **options.kwargs), args.repeat)]
+        if args.rootfile:
+            results.append(time_read(lambda: RootFile(args.inpath, entrystop=numevents, readOptions=options).get_masked_candidates(), args.repeat))
+
+        line = f'{numThreads:>8} {results[0]:>11.2f} {numBytes / 1024**2 / results[0]:>8.1f} {reference.setdefault(0, results[0]) / results[0]:>8.2f}'
+        if args.rootfile:
+            line += f' {results[1]:>13.2f} {reference.setdefault(1, results[1]) / results[1]:>8.2f}'
+        lines.append(line)
+
+    outdir = f'./output/{args.tag}'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    report = '\n'.join(lines)
+    print(report)
+    with open(pjoin(outdir, 'read_benchmark.txt'), 'w+') as f:
+        f.write(report + '\n')
+
+if __name__ == '__main__':
+    main()
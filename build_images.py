@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+
+from datetime import datetime
+from tqdm import tqdm
+from lib.imagebuilder import ImageBuilder, iterate_built_images
+from lib.imagestorage import STORAGE_MODES, get_image_codec
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+def get_dataset_name(filename):
+    temp = os.path.basename(filename).replace('.root','').split('_')
+    return '_'.join(temp[1:])
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_built_images')
+    parser.add_argument('--nEta', type=int, help='Number of eta bins.', default=50)
+    parser.add_argument('--nPhi', type=int, help='Number of phi bins.', default=50)
+    parser.add_argument('--etaRange', type=float, nargs=2, help='Eta range of the images.', default=[-5., 5.])
+    parser.add_argument('--phiRange', type=float, nargs=2, help='Phi range of the images.', default=[-np.pi, np.pi])
+    parser.add_argument('--pfTypes', nargs='+', help='PF candidate types to build images for.', default=['all'])
+    parser.add_argument('--puppiWeighted', action='store_true', help='Weight the PF candidate energies with their PUPPI weights.')
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=10000)
+    parser.add_argument('--imageStorage', help='Storage mode of the pixels in the output files.', choices=list(STORAGE_MODES), default='float32')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_cli()
+
+    outdir = f'./output/{args.tag}/built_images'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    dataset = get_dataset_name(args.inpath)
+
+    builder = ImageBuilder(nEta=args.nEta, nPhi=args.nPhi, etaRange=args.etaRange, phiRange=args.phiRange)
+    codec = get_image_codec(args.imageStorage)
+    codecParams = {f'codec_{k}' : v for k, v in codec.params.items()}
+
+    chunks = iterate_built_images(args.inpath, 
+        builder, 
+        pfTypes=args.pfTypes, 
+        puppiWeighted=args.puppiWeighted, 
+        chunksize=args.chunksize,
+        readOptions=get_read_options(args)
+        )
+
+    for ichunk, images in enumerate(tqdm(chunks)):
+        outpath = pjoin(outdir, f'{dataset}_chunk{ichunk}.npz')
+        np.savez(outpath, 
+            images=codec.encode(images), 
+            pfTypes=np.array(args.pfTypes),
+            etaRange=np.array(args.etaRange),
+            phiRange=np.array(args.phiRange),
+            **codecParams
+            )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+import mplhep as hep
+
+from datetime import datetime
+from matplotlib import pyplot as plt
+from tqdm import tqdm
+from lib.conesums import ConeSumCalculator, iterate_cone_sums
+from lib.histogrammer import Histogram
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+def get_dataset_name(filename):
+    temp = os.path.basename(filename).replace('.root','').split('_')
+    return '_'.join(temp[1:])
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_cone_closure')
+    parser.add_argument('--radii', type=float, nargs='+', help='Outer radii of the cone and annuli.', default=[0.4, 0.8])
+    parser.add_argument('--pfTypes', nargs='+', help='PF candidate types to compute the sums for.', default=['all'])
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=10000)
+    parser.add_argument('--noGenJetCleaning', action='store_true', help='Use all jets instead of the GEN-matched ones.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    if any(inner >= outer for inner, outer in zip(args.radii, args.radii[1:])):
+        parser.error('--radii must be strictly increasing, the last one sets the size of the window around each jet.')
+    return args
+
+def plot_closure(histogram, label, outpath):
+    fig, ax = plt.subplots()
+    hep.histplot(histogram.counts, histogram.edges, ax=ax)
+
+    ax.set_xlabel(f'Image energy ({label}) / Jet $p_T$')
+    ax.set_ylabel('Number of jets')
+    ax.set_yscale('log')
+
+    fig.savefig(outpath)
+    plt.close(fig)
+
+def main():
+    args = parse_cli()
+
+    outdir = f'./output/{args.tag}/cone_closure'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    dataset = get_dataset_name(args.inpath)
+    coneLabel = ConeSumCalculator(radii=args.radii).ring_labels[0]
+    coneColumn = f'energy_{args.pfTypes[0]}_{coneLabel}'
+
+    # Closure: energy in the innermost cone over the jet pt, over all jets in the file
+    histogram = Histogram('closure', np.linspace(0, 5, 101))
+
+    chunks = iterate_cone_sums(args.inpath,
+        radii=args.radii,
+        pfTypes=args.pfTypes,
+        chunksize=args.chunksize,
+        genJetCleaning=not args.noGenJetCleaning,
+        readOptions=get_read_options(args)
+        )
+
+    with open(pjoin(outdir, f'{dataset}_cone_sums.csv'), 'w+') as f:
+        for ichunk, table in enumerate(tqdm(chunks)):
+            if ichunk == 0:
+                f.write(','.join(table.keys()) + '\n')
+                # Integer columns (event and jet indices) are written in full, not in %g notation
+                fmt = ['%d' if np.issubdtype(np.asarray(column).dtype, np.integer) else '%.6g' for column in table.values()]
+            np.savetxt(f, np.column_stack(list(table.values())), delimiter=',', fmt=fmt)
+
+            histogram.fill(table[coneColumn] / table['jetPt'])
+
+    plot_closure(histogram, coneLabel, pjoin(outdir, f'{dataset}_closure.pdf'))
+
+if __name__ == '__main__':
+    main()
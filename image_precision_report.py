@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import uproot
+import numpy as np
+
+from datetime import datetime
+from lib.imagestorage import STORAGE_MODES, get_precision_report
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+# Image branches to compare
+BRANCHES = [
+    'EventImage_pixelsAfterPUPPI',
+    'EventImage_ChargedHadronPixels',
+    'EventImage_NeutralHadronPixels',
+    'EventImage_HFEMPixels',
+    'EventImage_HFHadronicPixels',
+]
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_precision_report')
+    parser.add_argument('--numevents', type=int, help='Number of events to use.', default=1000)
+    parser.add_argument('--modes', nargs='+', help='Storage modes to compare.', choices=list(STORAGE_MODES), default=list(STORAGE_MODES))
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_cli()
+
+    tree = uproot.open(args.inpath)['Events']
+    arrays = tree.arrays(BRANCHES, entrystop=args.numevents, namedecode='utf-8', **get_read_options(args).kwargs)
+
+    lines = [f'Precision report for {args.inpath}, {args.numevents} events']
+    lines.append('Relative errors are computed for pixels above 0.1 GeV.')
+    for branch in BRANCHES:
+        pixels = np.asarray(arrays[branch].flatten())
+        lines.append(f'\n{branch}: {pixels.nbytes / 1e6:.2f} MB in float64')
+        lines.append(f'{"mode":>8} {"MB":>8} {"ratio":>6} {"maxAbs":>10} {"maxRel":>10} {"meanRel":>10} {"sumRel":>10}')
+
+        report = get_precision_report(pixels, modes=args.modes)
+        for mode, r in report.items():
+            lines.append(
+                f'{mode:>8} {r["bytes"] / 1e6:>8.2f} {r["compression"]:>6.1f} '
+                f'{r["maxAbsError"]:>10.3g} {r["maxRelError"]:>10.3g} {r["meanRelError"]:>10.3g} {r["totalEnergyRelError"]:>10.3g}'
+            )
+
+    outdir = f'./output/{args.tag}'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    report = '\n'.join(lines)
+    print(report)
+    with open(pjoin(outdir, 'precision_report.txt'), 'w+') as f:
+        f.write(report + '\n')
+
+if __name__ == '__main__':
+    main()
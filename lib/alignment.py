@@ -0,0 +1,67 @@
+import numpy as np
+
+# Sortable key identifying a physics event
+EVENT_KEY_DTYPE = np.dtype([
+    ('run', np.uint32),
+    ('luminosityBlock', np.uint32),
+    ('event', np.uint64),
+])
+
+def get_event_keys(data) -> np.ndarray:
+    '''Structured (run, luminosityBlock, event) array for the events in data.'''
+    keys = np.empty(len(data['event']), dtype=EVENT_KEY_DTYPE)
+    for name in EVENT_KEY_DTYPE.names:
+        keys[name] = np.asarray(data[name])
+    return keys
+
+class EventAligner():
+    def __init__(self, keys0, keys1) -> None:
+        '''
+        Match the events of two files by their (run, luminosityBlock, event) keys,
+        with a sort-based join of the two key arrays.
+        After matching, entries0[i] and entries1[i] are the same physics event,
+        ordered as in the first file. Events appearing several times in a file
+        are matched by their first occurrence.
+        '''
+        self.keys = [keys0, keys1]
+
+        uniqueKeys, firstEntries, self.numDuplicates = [], [], []
+        for keys in self.keys:
+            unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+            uniqueKeys.append(unique)
+            firstEntries.append(first)
+            self.numDuplicates.append(int(np.count_nonzero(counts > 1)))
+
+        _, index0, index1 = np.intersect1d(uniqueKeys[0], uniqueKeys[1], assume_unique=True, return_indices=True)
+        entries0 = firstEntries[0][index0]
+        entries1 = firstEntries[1][index1]
+
+        order = np.argsort(entries0)
+        self.entries0 = entries0[order]
+        self.entries1 = entries1[order]
+
+        self.unmatched0 = np.setdiff1d(np.arange(len(keys0)), self.entries0)
+        self.unmatched1 = np.setdiff1d(np.arange(len(keys1)), self.entries1)
+
+    @staticmethod
+    def from_data(data0, data1):
+        '''Align two sets of masked data, see RootFile.get_masked_candidates().'''
+        return EventAligner(get_event_keys(data0), get_event_keys(data1))
+
+    @property
+    def pairs(self) -> tuple:
+        return self.entries0, self.entries1
+
+    def __len__(self):
+        return len(self.entries0)
+
+    def report(self, maxListed=20) -> str:
+        lines = [f'Matched events: {len(self)}']
+        for ifile, unmatched in enumerate([self.unmatched0, self.unmatched1]):
+            lines.append(f'File {ifile}: {len(self.keys[ifile])} events, {len(unmatched)} unmatched, '
+                f'{self.numDuplicates[ifile]} duplicated keys')
+            for key in self.keys[ifile][unmatched[:maxListed]]:
+                lines.append(f'    unmatched run={key["run"]} lumi={key["luminosityBlock"]} event={key["event"]}')
+            if len(unmatched) > maxListed:
+                lines.append(f'    ... and {len(unmatched) - maxListed} more')
+        return '\n'.join(lines)
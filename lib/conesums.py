@@ -0,0 +1,103 @@
+import numpy as np
+
+from .imagetools import ETA_RANGE, PHI_RANGE, stack_channels, pixel_index, jagged_local_index, gather_windows
+from .pipeline import ChunkPrefetcher, iterate_masked_data
+
+class ConeSumCalculator():
+    def __init__(self, radii=[0.4], pfTypes=['all']) -> None:
+        '''
+        Compute the image energy around each jet, in a cone and in annuli.
+        radii are the outer edges of the rings: [0.4, 0.8] gives dR < 0.4 and 0.4 <= dR < 0.8.
+        For each jet, a window of pixels covering the largest ring is gathered from the image,
+        and the energies are summed with masks built from the dR between the jet and the pixel centers.
+        '''
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.pfTypes = pfTypes
+
+    @property
+    def ring_labels(self) -> list:
+        labels = []
+        inner = 0.
+        for outer in self.radii:
+            labels.append(f'dR{inner:.1f}to{outer:.1f}'.replace('.', 'p'))
+            inner = outer
+        return labels
+
+    def _get_steps(self, width):
+        '''Pixel offsets of the window covering the largest ring.'''
+        halfSize = int(np.ceil(self.radii[-1] / width)) + 1
+        return np.arange(-halfSize, halfSize+1)
+
+    def compute_cone_sums(self, images, eventIndex, jetEta, jetPhi) -> np.ndarray:
+        '''Return the (nJets, nChannels, nRings) energy sums of (nEvents, nChannels, nEta, nPhi) images.'''
+        nEta, nPhi = images.shape[2:]
+        etaWidth = (ETA_RANGE[1] - ETA_RANGE[0]) / nEta
+        phiWidth = (PHI_RANGE[1] - PHI_RANGE[0]) / nPhi
+        etaSteps = self._get_steps(etaWidth)
+        phiSteps = self._get_steps(phiWidth)
+
+        ieta, iphi = pixel_index(jetEta, jetPhi, nEta, nPhi)
+        windows = gather_windows(images, eventIndex, ieta, iphi, etaSteps, phiSteps)
+
+        # Distance between each jet and the centers of the pixels in its window
+        etaCenters = ETA_RANGE[0] + (ieta[:,None] + etaSteps[None,:] + 0.5) * etaWidth
+        phiCenters = PHI_RANGE[0] + (iphi[:,None] + phiSteps[None,:] + 0.5) * phiWidth
+        deta = etaCenters - jetEta[:,None]
+        dphi = np.mod(phiCenters - jetPhi[:,None] + np.pi, 2*np.pi) - np.pi
+        deltaR = np.hypot(deta[:,:,None], dphi[:,None,:])
+
+        # Shape: (nJets, nRings, window eta, window phi)
+        inner = np.concatenate([[0.], self.radii[:-1]])
+        rings = (deltaR[:,None] >= inner[None,:,None,None]) & (deltaR[:,None] < self.radii[None,:,None,None])
+
+        return np.einsum('jcxy,jrxy->jcr', windows, rings.astype(windows.dtype))
+
+    def compute(self, masked_data, jets=None, eventOffset=0) -> dict:
+        '''
+        Return a per-jet table (dictionary of columns) with the jet kinematics
+        and the cone sums for each PF type and ring.
+        By default the jets in masked_data['jets'] are used.
+        '''
+        if jets is None:
+            jets = masked_data['jets']
+
+        counts = np.asarray(jets.counts)
+        eventIndex = np.repeat(np.arange(len(counts)), counts)
+        jetEta = np.asarray(jets.eta.flatten(), dtype=np.float64)
+        jetPhi = np.asarray(jets.phi.flatten(), dtype=np.float64)
+
+        table = {
+            'eventIndex' : eventIndex + eventOffset,
+            'jetIndex' : jagged_local_index(counts),
+            'jetPt' : np.asarray(jets.pt.flatten()),
+            'jetEta' : jetEta,
+            'jetPhi' : jetPhi,
+        }
+
+        if len(eventIndex) > 0:
+            images = stack_channels(masked_data, self.pfTypes)
+            sums = self.compute_cone_sums(images, eventIndex, jetEta, jetPhi)
+        else:
+            sums = np.zeros((0, len(self.pfTypes), len(self.radii)))
+
+        for ichannel, pfType in enumerate(self.pfTypes):
+            for iring, label in enumerate(self.ring_labels):
+                table[f'energy_{pfType}_{label}'] = sums[:,ichannel,iring]
+
+        return table
+
+def iterate_cone_sums(inpath, radii=[0.4], pfTypes=['all'], chunksize=10000, genJetCleaning=True, prefetchDepth=2, readOptions=None):
+    '''Stream the per-jet cone sum tables for a ROOT file, one per chunk of entries.'''
+    calculator = ConeSumCalculator(radii=radii, pfTypes=pfTypes)
+    prefetcher = ChunkPrefetcher(
+        iterate_masked_data(inpath, chunksize=chunksize, genJetCleaning=genJetCleaning, readOptions=readOptions),
+        depth=prefetchDepth
+    )
+
+    eventOffset = 0
+    try:
+        for masked_data in prefetcher:
+            yield calculator.compute(masked_data, eventOffset=eventOffset)
+            eventOffset += len(masked_data['jets'])
+    finally:
+        prefetcher.close()
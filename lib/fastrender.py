@@ -0,0 +1,145 @@
+import os
+import zlib
+import struct
+import numpy as np
+
+from matplotlib import pyplot as plt
+
+from .imagetools import ETA_RANGE, PHI_RANGE
+from .plotmaker import Plot2DMaker
+
+pjoin = os.path.join
+
+def encode_png(rgb, compression=1) -> bytes:
+    '''Encode an (height, width, 3) uint8 array as an RGB PNG file.'''
+    height, width, _ = rgb.shape
+    # Each row starts with the filter type byte, 0 = no filter
+    raw = np.zeros((height, 1 + 3*width), dtype=np.uint8)
+    raw[:,1:] = rgb.reshape(height, 3*width)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), compression)),
+        chunk(b'IEND', b''),
+    ])
+
+class FastImageRenderer():
+    def __init__(self, scale=4, cmap='viridis', vmin=1e-1, vmax=1e3, numColors=256, log=True) -> None:
+        '''
+        Render event images straight to RGB arrays, without matplotlib figures.
+        Uses the same log normalisation and colormap as ColormeshPlotter, through a
+        precomputed lookup table. Each image pixel is drawn as a scale x scale block.
+        With log=False, the normalisation is linear (e.g. for ratios).
+        '''
+        self.scale = scale
+        self.numColors = numColors
+        self.log = log
+        self.vmin = vmin
+        self.vmax = vmax
+        self.logmin = np.log10(vmin) if log else None
+        self.logmax = np.log10(vmax) if log else None
+
+        # The last entry is for empty (or undefined) pixels, which are not drawn on the matplotlib plots
+        lut = np.round(plt.get_cmap(cmap, numColors)(np.arange(numColors))[:,:3] * 255)
+        self.lut = np.vstack([lut, [255, 255, 255]]).astype(np.uint8)
+
+        self.colors = {
+            'black' : np.array([0, 0, 0], dtype=np.uint8),
+            'red' : np.array([255, 0, 0], dtype=np.uint8),
+        }
+        self._marker_offsets = {}
+
+    def colorize(self, pixels) -> np.ndarray:
+        '''Map an (nEta, nPhi) image to an RGB array with eta along x, and phi increasing upwards.'''
+        if self.log:
+            valid = pixels > 0
+            logpixels = np.log10(np.where(valid, pixels, 1.))
+            index = np.floor((logpixels - self.logmin) / (self.logmax - self.logmin) * self.numColors)
+        else:
+            valid = np.isfinite(pixels)
+            index = np.floor((np.where(valid, pixels, 0.) - self.vmin) / (self.vmax - self.vmin) * self.numColors)
+        index = np.where(valid, np.clip(index.astype(np.int64), 0, self.numColors-1), self.numColors)
+
+        rgb = self.lut[index.T[::-1]]
+        return np.repeat(np.repeat(rgb, self.scale, axis=0), self.scale, axis=1)
+
+    def _get_marker_offsets(self, shape):
+        '''(dy, dx) pixel offsets of the "x" marker and of the R=0.4 circle, cached per image shape.'''
+        if shape not in self._marker_offsets:
+            height, width = shape
+            radiusX = 0.4 / (ETA_RANGE[1] - ETA_RANGE[0]) * width
+            radiusY = 0.4 / (PHI_RANGE[1] - PHI_RANGE[0]) * height
+
+            angles = np.linspace(0, 2*np.pi, int(8 * max(radiusX, radiusY)) + 8, endpoint=False)
+            circle = np.unique(np.stack([
+                np.rint(radiusY * np.sin(angles)),
+                np.rint(radiusX * np.cos(angles)),
+            ], axis=1).astype(np.int64), axis=0)
+
+            size = max(self.scale, 3)
+            steps = np.arange(-size, size+1)
+            cross = np.concatenate([
+                np.stack([steps, steps], axis=1),
+                np.stack([steps, -steps], axis=1),
+            ])
+
+            self._marker_offsets[shape] = (cross, circle)
+        return self._marker_offsets[shape]
+
+    def draw_jets(self, rgb, jetEta, jetPhi, color='black') -> None:
+        '''Stamp "x" markers and R=0.4 circles for all jets at once.'''
+        if len(jetEta) == 0:
+            return
+        height, width, _ = rgb.shape
+        # Binned like the image cells (see imagetools.pixel_index), with phi increasing upwards
+        x = np.floor((np.asarray(jetEta) - ETA_RANGE[0]) / (ETA_RANGE[1] - ETA_RANGE[0]) * width).astype(np.int64)
+        y = height - 1 - np.floor((np.asarray(jetPhi) - PHI_RANGE[0]) / (PHI_RANGE[1] - PHI_RANGE[0]) * height).astype(np.int64)
+        x = np.clip(x, 0, width-1)
+        y = np.clip(y, 0, height-1)
+
+        for offsets in self._get_marker_offsets((height, width)):
+            ys = (y[:,None] + offsets[None,:,0]).ravel()
+            xs = (x[:,None] + offsets[None,:,1]).ravel()
+            inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+            rgb[ys[inside], xs[inside]] = self.colors[color]
+
+    def render(self, pixels, dataForEvent=None) -> np.ndarray:
+        '''Render one image, with the jets of dataForEvent (see EventBatch) if given.'''
+        rgb = self.colorize(pixels)
+        if dataForEvent is not None:
+            self.draw_jets(rgb, dataForEvent['jetEta'], dataForEvent['jetPhi'], color='black')
+            if 'nonMatchingJetEta' in dataForEvent:
+                self.draw_jets(rgb, dataForEvent['nonMatchingJetEta'], dataForEvent['nonMatchingJetPhi'], color='red')
+        return rgb
+
+    def render_png(self, pixels, dataForEvent=None) -> bytes:
+        return encode_png(self.render(pixels, dataForEvent))
+
+class FastPlotMaker(Plot2DMaker):
+    def __init__(self, data, tag, datasetName, pfType='all', jetsOnly=False, eventOffset=0, scale=4) -> None:
+        '''
+        Drop-in replacement for Plot2DMaker for bulk dumps: writes PNG images without
+        axes, text or legend, rendered with FastImageRenderer.
+        '''
+        super().__init__(data, tag, datasetName, pfType=pfType, jetsOnly=jetsOnly, eventOffset=eventOffset)
+        self.renderer = FastImageRenderer(scale=scale)
+
+        if self.jetsOnly:
+            self.outdir = f'./output/{tag}/jet_based_images_png'
+        else:
+            self.outdir = f'./output/{tag}/event_images_png'
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+
+    def make_plot(self, ievent, dataForEvent=None):
+        '''Write the PNG image for event # ievent.'''
+        if dataForEvent is None:
+            dataForEvent = self._get_data_for_event(ievent)
+
+        outfilename = f'{self.datasetName}_ievent_{ievent+self.eventOffset}_{self.pfType}.png'
+        with open(pjoin(self.outdir, outfilename), 'wb') as f:
+            f.write(self.renderer.render_png(dataForEvent['pixels'][0], dataForEvent))
@@ -0,0 +1,153 @@
+import os
+import ast
+import builtins
+import uproot
+import numpy as np
+
+from multiprocessing import Pool
+
+from .readoptions import ReadOptions
+
+# Names which can be used in the expressions without being branches
+EXPRESSION_NAMES = {'np'} | set(dir(builtins))
+
+class Histogram():
+    def __init__(self, name, edges, counts=None, underflow=0, overflow=0) -> None:
+        '''
+        Fixed-binning histogram which can be filled in chunks, and summed
+        across chunks, files and worker processes.
+        '''
+        self.name = name
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges)-1, dtype=np.int64) if counts is None else np.asarray(counts)
+        self.underflow = underflow
+        self.overflow = overflow
+
+    def fill(self, values) -> None:
+        values = np.asarray(values)
+        h, _ = np.histogram(values, bins=self.edges)
+        self.counts += h
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+
+    def __iadd__(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError(f'Cannot add histograms with different binnings: {self.name}, {other.name}')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def __add__(self, other):
+        result = Histogram(self.name, self.edges, self.counts.copy(), self.underflow, self.overflow)
+        result += other
+        return result
+
+class HistogramFiller():
+    def __init__(self, specs) -> None:
+        '''
+        Fill histograms for a list of (name, expression, edges) specifications.
+        An expression is either a branch name, or a python expression of branches
+        (e.g. "Jet_pt * (1 - Jet_rawFactor)") where numpy is available as np,
+        together with the python builtins (e.g. abs).
+        Jagged branches are flattened before filling.
+        '''
+        self.specs = specs
+        self.histograms = {name : Histogram(name, edges) for name, _, edges in specs}
+
+    @property
+    def branches(self) -> list:
+        '''Branches needed to evaluate all the expressions.'''
+        branches = set()
+        for _, expression, _ in self.specs:
+            for node in ast.walk(ast.parse(expression, mode='eval')):
+                if isinstance(node, ast.Name) and node.id not in EXPRESSION_NAMES:
+                    branches.add(node.id)
+        return sorted(branches)
+
+    def fill(self, arrays) -> None:
+        '''Fill the histograms from one chunk of branch arrays.'''
+        namespace = {'np' : np, **arrays}
+        for name, expression, _ in self.specs:
+            values = eval(expression, {}, namespace)
+            if hasattr(values, 'flatten'):
+                values = values.flatten()
+            self.histograms[name].fill(values)
+
+    def fill_file(self, inpath, treename='Events', chunksize=100000, readOptions=None) -> dict:
+        '''Fill the histograms from a ROOT file, reading chunksize entries at a time.'''
+        tree = uproot.open(inpath)[treename]
+        available = {name.decode('utf-8') for name in tree.keys()}
+        unknown = [name for name in self.branches if name not in available]
+        if unknown:
+            raise ValueError(f'Unknown branches in the histogram expressions: {", ".join(unknown)} (not in {inpath})')
+
+        readOptions = readOptions if readOptions is not None else ReadOptions.default()
+        for arrays in tree.iterate(self.branches, entrysteps=chunksize, namedecode='utf-8', **readOptions.kwargs):
+            self.fill(arrays)
+        return self.histograms
+
+def merge_histograms(histogramDicts) -> dict:
+    '''Sum dictionaries of histograms, name by name.'''
+    merged = {}
+    for histograms in histogramDicts:
+        for name, histogram in histograms.items():
+            if name in merged:
+                merged[name] += histogram
+            else:
+                merged[name] = histogram
+    return merged
+
+def _fill_single_file(args) -> dict:
+    inpath, specs, treename, chunksize, readOptions = args
+    return HistogramFiller(specs).fill_file(inpath, treename=treename, chunksize=chunksize, readOptions=readOptions)
+
+def fill_files(inpaths, specs, treename='Events', chunksize=100000, workers=1, readOptions=None) -> dict:
+    '''
+    Fill the histograms from a list of ROOT files, processing the files in
+    parallel with the given number of worker processes.
+    '''
+    readOptions = (readOptions if readOptions is not None else ReadOptions.default()).for_workers(workers)
+    jobs = [(inpath, specs, treename, chunksize, readOptions) for inpath in inpaths]
+    if workers <= 1:
+        return merge_histograms(map(_fill_single_file, jobs))
+
+    with Pool(workers) as pool:
+        return merge_histograms(pool.imap_unordered(_fill_single_file, jobs))
+
+def save_histograms(outpath, histograms) -> None:
+    '''Save a dictionary of histograms to a .npz file.'''
+    outdir = os.path.dirname(outpath)
+    if outdir and not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    content = {}
+    for name, histogram in histograms.items():
+        content[f'{name}/edges'] = histogram.edges
+        content[f'{name}/counts'] = histogram.counts
+        content[f'{name}/flow'] = np.array([histogram.underflow, histogram.overflow])
+    np.savez(outpath, **content)
+
+def load_histograms(inpath) -> dict:
+    '''Load a dictionary of histograms saved with save_histograms.'''
+    histograms = {}
+    with np.load(inpath) as f:
+        names = {key.rsplit('/', 1)[0] for key in f.files}
+        for name in names:
+            underflow, overflow = f[f'{name}/flow']
+            histograms[name] = Histogram(name,
+                f[f'{name}/edges'],
+                f[f'{name}/counts'],
+                int(underflow),
+                int(overflow)
+                )
+    return histograms
+
+def parse_histogram_spec(spec) -> tuple:
+    '''Parse a "name:expression:nbins:low:high" string into a (name, expression, edges) tuple.'''
+    try:
+        name, expression, nbins, low, high = spec.split(':')
+        edges = np.linspace(float(low), float(high), int(nbins)+1)
+    except ValueError:
+        raise ValueError(f'Invalid histogram specification "{spec}", expected name:expression:nbins:low:high')
+    return name, expression, edges
@@ -0,0 +1,109 @@
+import uproot
+import numpy as np
+
+from .imagetools import ETA_RANGE, PHI_RANGE
+from .readoptions import ReadOptions
+
+# |PDG ID| of the PF candidates entering the filtered images of each type
+PF_TYPE_PDGIDS = {
+    'ChargedHadron' : [211],
+    'NeutralHadron' : [130],
+    'HFEM' : [2],
+    'HFHadronic' : [1],
+}
+
+class ImageBuilder():
+    def __init__(self, nEta=50, nPhi=50, etaRange=ETA_RANGE, phiRange=PHI_RANGE) -> None:
+        '''
+        Build eta/phi images of arbitrary granularity and range directly from the PF candidates.
+        All events of a chunk are binned at once: the flat candidate arrays are mapped to a
+        single (event, channel, eta, phi) bin index and summed with one weighted bincount.
+        '''
+        self.nEta = nEta
+        self.nPhi = nPhi
+        self.etaRange = etaRange
+        self.phiRange = phiRange
+
+    def _bin_index(self, eta, phi):
+        '''Flat (ieta, iphi) bin index of each candidate, -1 for candidates outside the image.'''
+        etaLow, etaHigh = self.etaRange
+        phiLow, phiHigh = self.phiRange
+        # A full phi range wraps around: bring phi to [phiLow, phiLow + 2pi) before binning.
+        # Narrower ranges are binned as they are, dropping the candidates outside them.
+        if np.isclose(phiHigh - phiLow, 2*np.pi):
+            phi = np.mod(phi - phiLow, 2*np.pi) + phiLow
+
+        ieta = np.floor((eta - etaLow) / (etaHigh - etaLow) * self.nEta).astype(np.int64)
+        iphi = np.floor((phi - phiLow) / (phiHigh - phiLow) * self.nPhi).astype(np.int64)
+        inside = (ieta >= 0) & (ieta < self.nEta) & (iphi >= 0) & (iphi < self.nPhi)
+        return np.where(inside, ieta * self.nPhi + iphi, -1)
+
+    def build(self, counts, eta, phi, energy, channelMasks) -> np.ndarray:
+        '''
+        Return the (nEvents, nChannels, nEta, nPhi) images for flat candidate arrays
+        with the given number of candidates per event. channelMasks holds one boolean
+        array per channel, selecting the candidates entering that channel.
+        '''
+        counts = np.asarray(counts, dtype=np.int64)
+        nEvents = len(counts)
+        nChannels = len(channelMasks)
+        nPixels = self.nEta * self.nPhi
+
+        eventIndex = np.repeat(np.arange(nEvents), counts)
+        binIndex = self._bin_index(np.asarray(eta), np.asarray(phi))
+        energy = np.asarray(energy, dtype=np.float64)
+
+        indices, weights = [], []
+        for ichannel, mask in enumerate(channelMasks):
+            selected = mask & (binIndex >= 0)
+            indices.append((eventIndex[selected] * nChannels + ichannel) * nPixels + binIndex[selected])
+            weights.append(energy[selected])
+
+        images = np.bincount(
+            np.concatenate(indices),
+            weights=np.concatenate(weights),
+            minlength=nEvents * nChannels * nPixels,
+        )
+        return images.reshape(nEvents, nChannels, self.nEta, self.nPhi)
+
+    def build_from_arrays(self, arrays, pfTypes=['all'], puppiWeighted=False) -> np.ndarray:
+        '''Build the images from a chunk of PFCands_* branch arrays, see get_branches().'''
+        counts = arrays['PFCands_eta'].counts
+        energy = np.asarray(arrays['PFCands_energy'].flatten())
+        if puppiWeighted:
+            energy = energy * np.asarray(arrays['PFCands_puppiWeight'].flatten())
+
+        channelMasks = []
+        for pfType in pfTypes:
+            if pfType == 'all':
+                channelMasks.append(np.ones(len(energy), dtype=bool))
+            elif pfType not in PF_TYPE_PDGIDS:
+                raise ValueError(f'Unknown PF candidate type: {pfType}')
+            else:
+                pdgId = np.abs(np.asarray(arrays['PFCands_pdgId'].flatten()))
+                channelMasks.append(np.isin(pdgId, PF_TYPE_PDGIDS[pfType]))
+
+        return self.build(counts,
+            arrays['PFCands_eta'].flatten(),
+            arrays['PFCands_phi'].flatten(),
+            energy,
+            channelMasks
+            )
+
+    @staticmethod
+    def get_branches(pfTypes=['all'], puppiWeighted=False) -> list:
+        '''PF candidate branches needed to build the images.'''
+        branches = ['PFCands_eta', 'PFCands_phi', 'PFCands_energy']
+        if puppiWeighted:
+            branches.append('PFCands_puppiWeight')
+        if any(pfType != 'all' for pfType in pfTypes):
+            branches.append('PFCands_pdgId')
+        return branches
+
+def iterate_built_images(inpath, builder, pfTypes=['all'], puppiWeighted=False, chunksize=10000, readOptions=None):
+    '''Build the images for a ROOT file chunk by chunk, yielding one (nEvents, nChannels, nEta, nPhi) array per chunk.'''
+    tree = uproot.open(inpath)['Events']
+    branches = ImageBuilder.get_branches(pfTypes, puppiWeighted)
+    readOptions = readOptions if readOptions is not None else ReadOptions.default()
+    for arrays in tree.iterate(branches, entrysteps=chunksize, namedecode='utf-8', **readOptions.kwargs):
+        yield builder.build_from_arrays(arrays, pfTypes=pfTypes, puppiWeighted=puppiWeighted)
@@ -0,0 +1,100 @@
+import numpy as np
+
+class ImageCodec():
+    def __init__(self, dtype=np.float64) -> None:
+        '''
+        Storage format for image pixels. Pixels are encoded with encode() when they
+        are stored, and decoded to float64 with decode() before any computation.
+        '''
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def mode(self) -> str:
+        return self.dtype.name
+
+    @property
+    def params(self) -> dict:
+        '''Parameters needed to decode the stored pixels, saved together with exports.'''
+        return {'mode' : self.mode}
+
+    def encode(self, pixels) -> np.ndarray:
+        return np.asarray(pixels).astype(self.dtype, copy=False)
+
+    def decode(self, encoded) -> np.ndarray:
+        return np.asarray(encoded).astype(np.float64, copy=False)
+
+class LogQuantizedCodec(ImageCodec):
+    def __init__(self, dtype=np.uint8, vmin=1e-2, vmax=1e4) -> None:
+        '''
+        Store pixels as integers on a logarithmic scale between vmin and vmax (in GeV).
+        Code 0 is reserved for pixels below vmin, which are decoded as zero.
+        Pixels above vmax are clipped to vmax.
+        '''
+        super().__init__(dtype)
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.numLevels = np.iinfo(self.dtype).max
+        self._logmin = np.log(self.vmin)
+        self._logstep = (np.log(self.vmax) - self._logmin) / (self.numLevels - 1)
+
+    @property
+    def mode(self) -> str:
+        return f'log{8*self.dtype.itemsize}'
+
+    @property
+    def params(self) -> dict:
+        return {'mode' : self.mode, 'vmin' : self.vmin, 'vmax' : self.vmax}
+
+    def encode(self, pixels) -> np.ndarray:
+        pixels = np.asarray(pixels, dtype=np.float64)
+        aboveThreshold = pixels >= self.vmin
+        logpixels = np.log(np.clip(pixels, self.vmin, self.vmax))
+        codes = np.rint((logpixels - self._logmin) / self._logstep) + 1
+        return np.where(aboveThreshold, codes, 0).astype(self.dtype)
+
+    def decode(self, encoded) -> np.ndarray:
+        encoded = np.asarray(encoded)
+        pixels = np.exp(self._logmin + (encoded.astype(np.float64) - 1) * self._logstep)
+        return np.where(encoded > 0, pixels, 0.)
+
+# Available storage modes for the image pixels
+STORAGE_MODES = {
+    'float64' : lambda **kwargs: ImageCodec(np.float64),
+    'float32' : lambda **kwargs: ImageCodec(np.float32),
+    'float16' : lambda **kwargs: ImageCodec(np.float16),
+    'log8' : lambda **kwargs: LogQuantizedCodec(np.uint8, **kwargs),
+    'log16' : lambda **kwargs: LogQuantizedCodec(np.uint16, **kwargs),
+}
+
+def get_image_codec(mode='float64', **params) -> ImageCodec:
+    '''Return the codec for the given storage mode, e.g. get_image_codec(**codec.params).'''
+    try:
+        return STORAGE_MODES[mode](**params)
+    except KeyError:
+        raise ValueError(f'Unknown image storage mode: {mode}, available: {list(STORAGE_MODES)}')
+
+def get_precision_report(pixels, modes=STORAGE_MODES.keys(), threshold=1e-1) -> dict:
+    '''
+    Compare each storage mode against the original float64 pixels.
+    Relative errors are computed for pixels above threshold (in GeV), the lower
+    end of the colour scale used in the plots.
+    '''
+    pixels = np.asarray(pixels, dtype=np.float64)
+    visible = pixels >= threshold
+    report = {}
+    for mode in modes:
+        codec = get_image_codec(mode)
+        encoded = codec.encode(pixels)
+        decoded = codec.decode(encoded)
+
+        absError = np.abs(decoded - pixels)
+        relError = absError[visible] / pixels[visible]
+        report[mode] = {
+            'bytes' : encoded.nbytes,
+            'compression' : pixels.nbytes / encoded.nbytes,
+            'maxAbsError' : absError.max() if absError.size else 0.,
+            'maxRelError' : relError.max() if relError.size else 0.,
+            'meanRelError' : relError.mean() if relError.size else 0.,
+            'totalEnergyRelError' : abs(decoded.sum() - pixels.sum()) / pixels.sum() if pixels.sum() > 0 else 0.,
+        }
+    return report
@@ -0,0 +1,88 @@
+import numpy as np
+
+from .rootfile import PF_TYPE_ATTRIBUTES
+
+# Eta/phi range covered by the event images
+ETA_RANGE = (-5., 5.)
+PHI_RANGE = (-np.pi, np.pi)
+
+def get_image_shape(etaSize, phiSize):
+    '''Return the (nEta, nPhi) shape shared by all images in a set of events.'''
+    etaSizes = np.unique(np.asarray(etaSize))
+    phiSizes = np.unique(np.asarray(phiSize))
+    if len(etaSizes) != 1 or len(phiSizes) != 1:
+        raise ValueError(f'Expected a single image size, got nEta={etaSizes}, nPhi={phiSizes}')
+    return int(etaSizes[0]), int(phiSizes[0])
+
+def to_dense_images(pixels, etaSize, phiSize, codec=None):
+    '''
+    Convert jagged images (one flat list of pixels per event) into
+    a contiguous (nEvents, nEta, nPhi) array.
+    If the pixels are stored with a reduced precision codec, they are decoded to float64.
+    '''
+    nEvents = len(pixels)
+    if nEvents == 0:
+        return np.zeros((0, 0, 0))
+    nEta, nPhi = get_image_shape(etaSize, phiSize)
+    flat = pixels.flatten()
+    if codec is not None:
+        flat = codec.decode(flat)
+    return np.ascontiguousarray(flat).reshape(nEvents, nEta, nPhi)
+
+def get_pixels_key(pfType='all', tablename='eventImage'):
+    '''Key of the pixels for the given PF candidate type in the masked data.'''
+    if pfType not in PF_TYPE_ATTRIBUTES:
+        raise ValueError(f'Unknown PF candidate type: {pfType}')
+    return f'{tablename}_pixels' if pfType == 'all' else f'{tablename}_{pfType}Pixels'
+
+def stack_channels(masked_data, pfTypes=['all'], tablename='eventImage', start=None, stop=None, entries=None):
+    '''
+    Stack the images of several PF candidate types for events in [start, stop),
+    or for the given event indices if entries is specified,
+    into a contiguous (nEvents, nChannels, nEta, nPhi) float64 array.
+    '''
+    selection = slice(start, stop) if entries is None else np.asarray(entries)
+    codec = masked_data.get('imageCodec')
+    etaSize = masked_data[f'{tablename}_nEta'][selection]
+    phiSize = masked_data[f'{tablename}_nPhi'][selection]
+    channels = []
+    for pfType in pfTypes:
+        pixels = masked_data[get_pixels_key(pfType, tablename)][selection]
+        channels.append(to_dense_images(pixels, etaSize, phiSize, codec=codec))
+    return np.ascontiguousarray(np.stack(channels, axis=1))
+
+def pixel_index(eta, phi, nEta, nPhi):
+    '''Return the (ieta, iphi) indices of the pixels containing the given eta/phi positions.'''
+    eta = np.asarray(eta, dtype=np.float64)
+    phi = np.asarray(phi, dtype=np.float64)
+    ieta = np.floor((eta - ETA_RANGE[0]) / (ETA_RANGE[1] - ETA_RANGE[0]) * nEta).astype(np.int64)
+    iphi = np.floor((phi - PHI_RANGE[0]) / (PHI_RANGE[1] - PHI_RANGE[0]) * nPhi).astype(np.int64)
+    # Eta is clipped at the image edge, phi is periodic
+    return np.clip(ieta, 0, nEta-1), iphi % nPhi
+
+def jagged_local_index(counts):
+    '''Index of each object within its own event, for a flat array built from counts.'''
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+def gather_windows(images, eventIndex, ieta, iphi, etaSteps, phiSteps):
+    '''
+    Gather the windows of (nEvents, nChannels, nEta, nPhi) images around the given pixels,
+    at the given eta/phi pixel offsets, into a (nCenters, nChannels, len(etaSteps), len(phiSteps)) array.
+    Windows wrap around in phi and are zero-padded beyond the eta edges of the image.
+    '''
+    _, nChannels, nEta, nPhi = images.shape
+    etaIdx = ieta[:,None] + etaSteps[None,:]
+    phiIdx = (iphi[:,None] + phiSteps[None,:]) % nPhi
+    insideEta = (etaIdx >= 0) & (etaIdx < nEta)
+    etaIdx = np.clip(etaIdx, 0, nEta-1)
+
+    windows = images[
+        eventIndex[:,None,None,None],
+        np.arange(nChannels)[None,:,None,None],
+        etaIdx[:,None,:,None],
+        phiIdx[:,None,None,:],
+    ]
+    windows *= insideEta[:,None,:,None]
+    return np.ascontiguousarray(windows)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from .imagetools import stack_channels, pixel_index, jagged_local_index, gather_windows
+from .pipeline import ChunkPrefetcher, iterate_masked_data
+
+class JetPatchExtractor():
+    def __init__(self, patchSize=32, pfTypes=['all']) -> None:
+        '''
+        Extract fixed-size KxK eta/phi patches of the event images, centered on each jet.
+        Patches wrap around in phi and are zero-padded beyond the eta edges of the image.
+        '''
+        self.patchSize = patchSize
+        self.pfTypes = pfTypes
+
+    def _gather(self, images, eventIndex, ieta, iphi):
+        '''Gather the patches around the given pixels with vectorized indexing.'''
+        steps = np.arange(self.patchSize) - self.patchSize // 2
+        return gather_windows(images, eventIndex, ieta, iphi, steps, steps)
+
+    def extract(self, masked_data, jets=None, eventOffset=0) -> dict:
+        '''
+        Return the patches of all jets in masked_data, together with the jet metadata.
+        By default the jets in masked_data['jets'] are used.
+        eventOffset is added to the event index, to keep it unique across chunks.
+        '''
+        if jets is None:
+            jets = masked_data['jets']
+
+        counts = np.asarray(jets.counts)
+        eventIndex = np.repeat(np.arange(len(counts)), counts)
+        jetEta = np.asarray(jets.eta.flatten())
+        jetPhi = np.asarray(jets.phi.flatten())
+        jetPt = np.asarray(jets.pt.flatten())
+
+        images = stack_channels(masked_data, self.pfTypes)
+        if len(eventIndex) > 0:
+            ieta, iphi = pixel_index(jetEta, jetPhi, images.shape[2], images.shape[3])
+            patches = self._gather(images, eventIndex, ieta, iphi)
+        else:
+            patches = np.zeros((0, len(self.pfTypes), self.patchSize, self.patchSize))
+
+        return {
+            'patches' : patches,
+            'eventIndex' : eventIndex + eventOffset,
+            'jetIndex' : jagged_local_index(counts),
+            'jetPt' : jetPt,
+            'jetEta' : jetEta,
+            'jetPhi' : jetPhi,
+        }
+
+def iterate_jet_patches(inpath, patchSize=32, pfTypes=['all'], chunksize=10000, genJetCleaning=True, prefetchDepth=2, imageStorage='float64', readOptions=None):
+    '''
+    Stream the jet patches for a ROOT file, yielding one dictionary per chunk of entries.
+    With genJetCleaning=True, only the GEN-matched jets are used.
+    '''
+    extractor = JetPatchExtractor(patchSize=patchSize, pfTypes=pfTypes)
+    prefetcher = ChunkPrefetcher(
+        iterate_masked_data(inpath, chunksize=chunksize, genJetCleaning=genJetCleaning, imageStorage=imageStorage, readOptions=readOptions),
+        depth=prefetchDepth
+    )
+
+    eventOffset = 0
+    try:
+        for masked_data in prefetcher:
+            yield extractor.extract(masked_data, eventOffset=eventOffset)
+            eventOffset += len(masked_data['jets'])
+    finally:
+        prefetcher.close()
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import resource
+import threading
+import tracemalloc
+import uproot
+
+from contextlib import contextmanager
+
+# Branches read by RootFile, used to estimate the memory needed per event
+READ_BRANCHES = [
+    'nGenJet', 'GenJet_pt', 'GenJet_eta', 'GenJet_phi', 'GenJet_mass',
+    'nJet', 'Jet_pt', 'Jet_eta', 'Jet_phi', 'Jet_mass',
+    'nEventImage', 'EventImage_pixelsAfterPUPPI', 'EventImage_HFHadronicPixels', 'EventImage_HFEMPixels',
+    'EventImage_ChargedHadronPixels', 'EventImage_NeutralHadronPixels',
+    'EventImageSize_nEtaBins', 'EventImageSize_nPhiBins',
+    'nJetImage', 'JetImage_pixels', 'JetImageSize_nEtaBins', 'JetImageSize_nPhiBins',
+]
+
+# Large image branches, read up front by RootFile and stored with the image codec
+IMAGE_BRANCHES = [
+    'EventImage_pixelsAfterPUPPI',
+    'EventImage_HFHadronicPixels',
+    'EventImage_HFEMPixels',
+    'EventImage_ChargedHadronPixels',
+    'EventImage_NeutralHadronPixels',
+    'JetImage_pixels',
+]
+
+def parse_size(size) -> int:
+    '''Parse a memory size like "4GB", "500MB" or "2048" (in MB) into bytes.'''
+    units = {'KB' : 1024, 'MB' : 1024**2, 'GB' : 1024**3, 'TB' : 1024**4}
+    size = str(size).strip().upper()
+    for unit, factor in units.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(float(size) * units['MB'])
+
+def get_rss_bytes() -> int:
+    '''Current resident set size of the process.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return get_peak_rss_bytes()
+
+def get_peak_rss_bytes() -> int:
+    '''Peak resident set size of the process so far.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kB on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def get_stored_itemsize(branch, default=4) -> int:
+    '''Size in bytes of one value of a (possibly jagged) numeric branch, as stored in the file.'''
+    interpretation = branch.interpretation
+    interpretation = getattr(interpretation, 'content', interpretation)
+    dtype = getattr(interpretation, 'fromdtype', None)
+    return dtype.itemsize if dtype is not None else default
+
+def estimate_bytes_per_event(tree, branches=READ_BRANCHES, overhead=2., imageCodec=None) -> float:
+    '''
+    Estimate the memory needed per event to read and prepare a chunk with RootFile,
+    from the uncompressed branch sizes and the image dimensions.
+    With an image codec, the image branches are counted at their encoded size.
+    overhead accounts for the temporary copies made while masking and cleaning.
+    '''
+    numentries = max(tree.numentries, 1)
+    available = {name.decode('utf-8') for name in tree.keys()}
+
+    branchBytes = 0.
+    for name in branches:
+        if name not in available:
+            continue
+        numBytes = tree[name].uncompressedbytes()
+        if imageCodec is not None and name in IMAGE_BRANCHES:
+            numBytes *= imageCodec.dtype.itemsize / get_stored_itemsize(tree[name])
+        branchBytes += numBytes
+
+    # Each image collection also stores a dummy float32 momentum component per pixel
+    dummyBytes = 0.
+    for table in ['EventImage', 'JetImage']:
+        if f'{table}Size_nEtaBins' not in available:
+            continue
+        nEta = tree[f'{table}Size_nEtaBins'].array(entrystop=1)
+        nPhi = tree[f'{table}Size_nPhiBins'].array(entrystop=1)
+        if len(nEta) > 0:
+            dummyBytes += 4 * int(nEta[0]) * int(nPhi[0])
+
+    return overhead * branchBytes / numentries + dummyBytes
+
+class MemoryBudget():
+    def __init__(self, budgetBytes, bytesPerEvent, numChunksInMemory=1, safety=0.8, minChunksize=100, maxChunksize=1000000) -> None:
+        '''
+        Choose chunk sizes so that numChunksInMemory chunks (e.g. the one being processed plus
+        the prefetched ones) fit within the memory budget, on top of the current baseline usage.
+        The per-event estimate is updated from the RSS growth measured while each chunk is read.
+        '''
+        self.budgetBytes = budgetBytes
+        self.bytesPerEvent = bytesPerEvent
+        self.numChunksInMemory = numChunksInMemory
+        self.safety = safety
+        self.minChunksize = minChunksize
+        self.maxChunksize = maxChunksize
+
+        self.baselineBytes = get_rss_bytes()
+        # (chunksize, bytes per event) used for each chunk
+        self.history = []
+
+    @staticmethod
+    def from_file(inpath, budgetBytes, imageCodec=None, **kwargs):
+        tree = uproot.open(inpath)['Events']
+        return MemoryBudget(budgetBytes, estimate_bytes_per_event(tree, imageCodec=imageCodec), **kwargs)
+
+    def get_chunksize(self) -> int:
+        available = self.safety * self.budgetBytes - self.baselineBytes
+        chunksize = int(available / (self.numChunksInMemory * self.bytesPerEvent))
+        return min(max(chunksize, self.minChunksize), self.maxChunksize)
+
+    def observe(self, chunksize, chunkBytes) -> None:
+        '''
+        Update the per-event estimate after a chunk of chunksize entries has been read,
+        with chunkBytes the growth of the RSS while reading that single chunk.
+        '''
+        self.history.append((chunksize, self.bytesPerEvent))
+        # No growth when the chunk reused memory freed by earlier chunks, nothing to learn
+        if chunkBytes <= 0:
+            return
+        measured = chunkBytes / max(chunksize, 1)
+        if get_rss_bytes() > self.safety * self.budgetBytes:
+            # Over budget, shrink the next chunk right away
+            self.bytesPerEvent = max(self.bytesPerEvent, measured)
+        else:
+            self.bytesPerEvent = 0.5 * (self.bytesPerEvent + measured)
+
+    def report(self) -> str:
+        lines = [f'Memory budget: {self.budgetBytes / 1024**2:.0f} MB, baseline RSS: {self.baselineBytes / 1024**2:.0f} MB']
+        for ichunk, (chunksize, bytesPerEvent) in enumerate(self.history):
+            lines.append(f'Chunk {ichunk}: {chunksize} entries, estimated {bytesPerEvent / 1024:.1f} kB/event')
+        return '\n'.join(lines)
+
+class StageProfiler():
+    def __init__(self, enabled=True, numTop=10) -> None:
+        '''
+        Record wall time, RSS and the top tracemalloc allocators for each stage of a job.
+        The RSS is measured before and after each call of a stage, and the largest value
+        after a call and the largest growth during a call are reported.
+        tracemalloc traces the whole process, so while profiling, stages run one at a time:
+        a stage in another thread (e.g. the prefetcher) waits until the current one is done.
+        This gives up the overlap of reading and plotting, but keeps the traced peaks apart.
+        '''
+        self.enabled = enabled
+        self.numTop = numTop
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._stageLock = threading.Lock()
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        with self._stageLock:
+            start = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            rssBefore = get_rss_bytes()
+            starttime = time.time()
+            try:
+                yield
+            finally:
+                stats = tracemalloc.take_snapshot().compare_to(start, 'lineno')
+                _, tracedPeak = tracemalloc.get_traced_memory()
+                self._record(name, starttime, tracedPeak, rssBefore, get_rss_bytes(), stats)
+
+    def _record(self, name, starttime, tracedPeak, rssBefore, rssAfter, stats) -> None:
+        with self._lock:
+            record = self.stages.setdefault(name, {'calls' : 0, 'time' : 0., 'tracedPeak' : 0, 'rss' : 0, 'rssGrowth' : 0, 'top' : {}})
+            record['calls'] += 1
+            record['time'] += time.time() - starttime
+            record['tracedPeak'] = max(record['tracedPeak'], tracedPeak)
+            record['rss'] = max(record['rss'], rssAfter)
+            record['rssGrowth'] = max(record['rssGrowth'], rssAfter - rssBefore)
+            for stat in stats[:self.numTop]:
+                location = str(stat.traceback[0])
+                record['top'][location] = max(record['top'].get(location, 0), stat.size_diff)
+
+    def report(self) -> str:
+        lines = [f'Peak RSS: {get_peak_rss_bytes() / 1024**2:.1f} MB']
+        lines.append('Stages were run one at a time while profiling, reading did not overlap plotting.')
+        for name, record in self.stages.items():
+            lines.append(f'\nStage "{name}": {record["calls"]} calls, {record["time"]:.2f} s, '
+                f'RSS after {record["rss"] / 1024**2:.1f} MB (max growth {record["rssGrowth"] / 1024**2:+.1f} MB), '
+                f'peak traced {record["tracedPeak"] / 1024**2:.1f} MB')
+            top = sorted(record['top'].items(), key=lambda item: -item[1])[:self.numTop]
+            for location, size in top:
+                lines.append(f'    {size / 1024**2:10.2f} MB  {location}')
+        return '\n'.join(lines)
+
+def write_memory_report(tag, profiler, memoryBudget=None) -> None:
+    '''Write the memory report of a job to ./output/<tag>/memory_report.txt'''
+    outdir = f'./output/{tag}'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    with open(os.path.join(outdir, 'memory_report.txt'), 'w+') as f:
+        if memoryBudget is not None:
+            f.write(memoryBudget.report() + '\n\n')
+        f.write(profiler.report() + '\n')
@@ -0,0 +1,93 @@
+import queue
+import threading
+
+from contextlib import nullcontext
+
+from .genjetcleaner import GenJetCleaner
+from .rootfile import RootFile
+
+def prepare_masked_data(rootfile, genJetCleaning=True):
+    '''
+    Return the data for events passing the VBF cuts.
+    With genJetCleaning=True, only the RECO jets matching a GEN jet with dR=0.4
+    are kept in 'jets', and the rest are stored as 'non_matching_jets'.
+    '''
+    masked_data = rootfile.get_masked_candidates()
+    if genJetCleaning:
+        cleaner = GenJetCleaner(masked_data['jets'], masked_data['genJets'])
+        masked_data['jets'] = cleaner.get_clean_jets()
+        masked_data['non_matching_jets'] = cleaner.get_nonmatching_jets()
+    return masked_data
+
+def iterate_masked_data(inpath, chunksize=10000, genJetCleaning=True, profiler=None, **kwargs):
+    '''
+    Read, mask and clean consecutive chunks of a ROOT file.
+    Other keyword arguments (e.g. imageStorage, memoryBudget) are passed to RootFile.iterate().
+    If a StageProfiler is given, the reading and preparation are recorded as stages.
+    '''
+    chunks = RootFile.iterate(inpath, chunksize=chunksize, **kwargs)
+    while True:
+        with profiler.stage('read') if profiler else nullcontext():
+            rootfile = next(chunks, None)
+        if rootfile is None:
+            return
+        with profiler.stage('prepare') if profiler else nullcontext():
+            masked_data = prepare_masked_data(rootfile, genJetCleaning=genJetCleaning)
+        # Hold no reference to this chunk while the next one is read, only the consumer keeps it
+        del rootfile
+        yield masked_data
+        del masked_data
+
+class ChunkPrefetcher():
+    # Marks the end of the producer's iterator in the queue
+    _DONE = object()
+
+    def __init__(self, chunks, depth=2) -> None:
+        '''
+        Run the chunks iterator in a background thread, so that the next chunks are read
+        and prepared while the current one is being processed.
+        At most depth prepared chunks are held in memory at once.
+        '''
+        self.chunks = chunks
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        '''Put an item in the queue, giving up if the consumer has stopped.'''
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        try:
+            for chunk in self.chunks:
+                if not self._put(chunk):
+                    return
+        except BaseException as e:
+            # Re-raised in the consumer thread
+            self._put(e)
+            return
+        self._put(self._DONE)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        '''Stop the background thread, e.g. when the consumer breaks out early.'''
+        self._stop.set()
+        self._thread.join()
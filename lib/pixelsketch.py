@@ -0,0 +1,152 @@
+import os
+import numpy as np
+
+from multiprocessing import Pool
+
+from .imagetools import stack_channels
+from .pipeline import ChunkPrefetcher, iterate_masked_data
+from .readoptions import ReadOptions
+
+class PixelHistogramSketch():
+    def __init__(self, shape, vmin=1e-2, vmax=1e4, numBins=64, counts=None, numEvents=0) -> None:
+        '''
+        Log-binned histogram of the energy in every (channel, eta, phi) pixel, filled one
+        chunk of events at a time. Its size is fixed by the image shape and the number of bins,
+        and does not grow with the number of events. Sketches are merged by adding them.
+        Bin 0 counts the events with energy below vmin, and the last bin those above vmax.
+        '''
+        self.shape = tuple(shape)
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.numBins = numBins
+        self.edges = np.geomspace(self.vmin, self.vmax, numBins+1)
+        self._logmin = np.log(self.vmin)
+        self._logstep = (np.log(self.vmax) - self._logmin) / numBins
+
+        if counts is None:
+            counts = np.zeros(self.shape + (numBins+2,), dtype=np.int64)
+        self.counts = counts
+        self.numEvents = numEvents
+
+    def _bin_index(self, values) -> np.ndarray:
+        aboveMin = values >= self.vmin
+        logvalues = np.log(np.where(aboveMin, values, self.vmin))
+        index = np.floor((logvalues - self._logmin) / self._logstep).astype(np.int64) + 1
+        return np.where(aboveMin, np.minimum(index, self.numBins+1), 0)
+
+    def fill(self, images) -> None:
+        '''Fill the sketch with (nEvents, nChannels, nEta, nPhi) images.'''
+        images = np.asarray(images)
+        if images.shape[1:] != self.shape:
+            raise ValueError(f'Image shape {images.shape[1:]} does not match the sketch shape {self.shape}')
+
+        numPixels = int(np.prod(self.shape))
+        numSlots = self.numBins + 2
+        # One bincount over all events: slot = pixel * numSlots + bin
+        slots = np.arange(numPixels) * numSlots + self._bin_index(images.reshape(len(images), numPixels))
+        counts = np.bincount(slots.ravel(), minlength=numPixels*numSlots)
+
+        self.counts += counts.reshape(self.counts.shape)
+        self.numEvents += len(images)
+
+    def _check_compatible(self, other) -> None:
+        if self.shape != other.shape or not np.array_equal(self.edges, other.edges):
+            raise ValueError('Cannot merge pixel sketches with different shapes or binnings')
+
+    def __iadd__(self, other):
+        self._check_compatible(other)
+        self.counts += other.counts
+        self.numEvents += other.numEvents
+        return self
+
+    def __add__(self, other):
+        result = PixelHistogramSketch(self.shape, self.vmin, self.vmax, self.numBins, self.counts.copy(), self.numEvents)
+        result += other
+        return result
+
+    def quantile(self, q) -> np.ndarray:
+        '''
+        Per-pixel q-quantile (0 < q < 1) of the energy, as a (nChannels, nEta, nPhi) map.
+        Values are interpolated log-linearly within the bins, values below vmin are reported as 0.
+        '''
+        if self.numEvents == 0:
+            return np.zeros(self.shape)
+        target = q * self.numEvents
+        cumulative = np.cumsum(self.counts, axis=-1)
+        index = np.argmax(cumulative >= target, axis=-1)
+
+        before = np.take_along_axis(cumulative, index[...,None], axis=-1)[...,0] - \
+            np.take_along_axis(self.counts, index[...,None], axis=-1)[...,0]
+        inBin = np.take_along_axis(self.counts, index[...,None], axis=-1)[...,0]
+        fraction = np.clip((target - before) / np.maximum(inBin, 1), 0., 1.)
+
+        values = np.exp(self._logmin + (index - 1 + fraction) * self._logstep)
+        values = np.where(index == 0, 0., values)
+        return np.where(index == self.numBins+1, self.vmax, values)
+
+    def median(self) -> np.ndarray:
+        return self.quantile(0.5)
+
+    def occupancy(self) -> np.ndarray:
+        '''Per-pixel fraction of events with an energy of at least vmin.'''
+        if self.numEvents == 0:
+            return np.zeros(self.shape)
+        return 1. - self.counts[...,0] / self.numEvents
+
+    def save(self, outpath) -> None:
+        outdir = os.path.dirname(outpath)
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
+        np.savez(outpath,
+            counts=self.counts,
+            numEvents=self.numEvents,
+            binning=np.array([self.vmin, self.vmax, self.numBins]),
+            )
+
+    @staticmethod
+    def load(inpath):
+        with np.load(inpath) as f:
+            vmin, vmax, numBins = f['binning']
+            counts = f['counts']
+            return PixelHistogramSketch(counts.shape[:-1], vmin, vmax, int(numBins), counts, int(f['numEvents']))
+
+def fill_sketch(inpath, pfTypes=['all'], chunksize=10000, prefetchDepth=2, readOptions=None, **kwargs) -> PixelHistogramSketch:
+    '''Fill a pixel sketch with all events of a ROOT file passing the VBF cuts, chunk by chunk.'''
+    sketch = None
+    prefetcher = ChunkPrefetcher(
+        iterate_masked_data(inpath, chunksize=chunksize, genJetCleaning=False, readOptions=readOptions),
+        depth=prefetchDepth
+    )
+    try:
+        for masked_data in prefetcher:
+            if len(masked_data['jets']) == 0:
+                continue
+            images = stack_channels(masked_data, pfTypes)
+            if sketch is None:
+                sketch = PixelHistogramSketch(images.shape[1:], **kwargs)
+            sketch.fill(images)
+    finally:
+        prefetcher.close()
+    return sketch
+
+def _fill_single_file(args):
+    inpath, kwargs = args
+    return fill_sketch(inpath, **kwargs)
+
+def fill_sketch_files(inpaths, workers=1, readOptions=None, **kwargs) -> PixelHistogramSketch:
+    '''Fill and merge the pixel sketches of several ROOT files, with the given number of worker processes.'''
+    kwargs['readOptions'] = (readOptions if readOptions is not None else ReadOptions.default()).for_workers(workers)
+    jobs = [(inpath, kwargs) for inpath in inpaths]
+    if workers <= 1:
+        sketches = map(_fill_single_file, jobs)
+        return _merge(sketches)
+    with Pool(workers) as pool:
+        return _merge(pool.imap_unordered(_fill_single_file, jobs))
+
+def _merge(sketches):
+    merged = None
+    for sketch in sketches:
+        if sketch is None:
+            continue
+        merged = sketch if merged is None else merged + sketch
+    return merged
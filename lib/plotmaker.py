@@ -3,25 +3,42 @@ import re
 import numpy as np
 
 from .genjetcleaner import GenJetCleaner
+from .imagetools import get_image_shape, stack_channels
 
 from matplotlib import pyplot as plt
 from matplotlib import colors
 
 pjoin = os.path.join
 
+# Dataset name regex -> label to put on the plots
+DATASET_TAGS = [
+    (re.compile(r'Z(\d)JetsToNuNu.*Pt.*FXFX.*'), r'QCD $Z(\nu\nu)$'),
+    (re.compile(r'EWKZ2Jets.*ZToNuNu.*'), r'EWK $Z(\nu\nu)$'),
+    (re.compile(r'VBF_HToInv.*M125.*'), r'VBF $H(inv)$'),
+]
+
+def get_dataset_tag(datasetName):
+    for regex, tag in DATASET_TAGS:
+        if regex.match(datasetName):
+            return tag
+
 class ColormeshPlotter():
     def __init__(self) -> None:
         '''Base class with ax.pcolormesh() call.'''
         pass
 
+    def draw_cmesh(self, ax, etaSize, phiSize, pixels):
+        '''Draw the 2D colormesh on the given axis.'''
+        etaBins = np.linspace(-5,5,etaSize)
+        phiBins = np.linspace(-np.pi,np.pi,phiSize)
+
+        return ax.pcolormesh(etaBins, phiBins, pixels.T, norm=colors.LogNorm(vmin=1e-1, vmax=1e3))
+
     def make_cmesh_plot(self, etaSize, phiSize, pixels, title=''):
         '''Base function for making a 2D colormesh plot.'''
         fig, ax = plt.subplots()
         
-        etaBins = np.linspace(-5,5,etaSize)
-        phiBins = np.linspace(-np.pi,np.pi,phiSize)
-
-        cmap = ax.pcolormesh(etaBins, phiBins, pixels.T, norm=colors.LogNorm(vmin=1e-1, vmax=1e3))
+        cmap = self.draw_cmesh(ax, etaSize, phiSize, pixels)
         ax.set_xlabel(r'PF Candidate $\eta$')
         ax.set_ylabel(r'PF Candidate $\phi$')
 
@@ -48,76 +65,78 @@ class PlotSaver():
         self.figure.savefig(outpath)
         plt.close(self.figure)
 
+class EventBatch():
+    # Jet collections to slice -> prefix of the per-event keys
+    jetCollections = {
+        'jets' : 'jet',
+        'non_matching_jets' : 'nonMatchingJet',
+    }
+
+    def __init__(self, data, start, stop, tablename='eventImage', pfTypes=['all']) -> None:
+        '''
+        Slice every collection needed for plotting once for the events in [start, stop),
+        into flat NumPy arrays with offsets. The data for each event is then a cheap view.
+        The images of all requested PF types are stacked as channels.
+        '''
+        self.start = start
+        self.stop = min(stop, len(data['jets']))
+
+        self.collections = {}
+        for key, prefix in self.jetCollections.items():
+            if key not in data:
+                continue
+            jets = data[key][self.start:self.stop]
+            self.collections[prefix] = {
+                'offsets' : np.concatenate([[0], np.cumsum(jets.counts)]),
+                'Pt' : np.asarray(jets.pt.flatten()),
+                'Eta' : np.asarray(jets.eta.flatten()),
+                'Phi' : np.asarray(jets.phi.flatten()),
+            }
+
+        # Shape: (nEvents, nChannels, nEta, nPhi)
+        self.pixels = stack_channels(data, pfTypes, tablename=tablename, start=self.start, stop=self.stop)
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __getitem__(self, i) -> dict:
+        '''Views of the data for event # start+i, pixels have shape (nChannels, nEta, nPhi).'''
+        dataForEvent = {'pixels' : self.pixels[i]}
+        for prefix, collection in self.collections.items():
+            lo, hi = collection['offsets'][i], collection['offsets'][i+1]
+            for variable in ['Pt', 'Eta', 'Phi']:
+                dataForEvent[f'{prefix}{variable}'] = collection[variable][lo:hi]
+        return dataForEvent
+
 class Plot2DMaker(ColormeshPlotter):
-    def __init__(self, data, tag, datasetName, pfType='all', jetsOnly=False) -> None:
+    def __init__(self, data, tag, datasetName, pfType='all', jetsOnly=False, eventOffset=0) -> None:
         super().__init__()
         self.data = data
         self.tag = tag
         self.datasetName = datasetName
         # Type of PF candidate collection for the event image
         self.pfType = pfType
+        self.pfTypes = [pfType]
         # Only read the collection of PF candidates coming from jets?
         self.jetsOnly = jetsOnly
-        self.tablename = "JetImage" if self.jetsOnly else "EventImage"
-
-        self.dataset_tags = {
-            'Z(\d)JetsToNuNu.*Pt.*FXFX.*' : r'QCD $Z(\nu\nu)$',
-            'EWKZ2Jets.*ZToNuNu.*' : r'EWK $Z(\nu\nu)$',
-            'VBF_HToInv.*M125.*' : r'VBF $H(inv)$',
-        }
+        self.tablename = "jetImage" if self.jetsOnly else "eventImage"
+        # Index of the first event in data, if it is a chunk of a larger file
+        self.eventOffset = eventOffset
 
     def _get_dataset_tag(self, datasetName):
-        for regex, tag in self.dataset_tags.items():
-            if re.match(regex, datasetName):
-                return tag
+        return get_dataset_tag(datasetName)
 
     def _get_data_for_event(self, ievent):
-        dataForEvent = {}
-        dataForEvent['jetPt'] = self.data['jets'].pt[ievent]
-        dataForEvent['jetEta'] = self.data['jets'].eta[ievent]
-        dataForEvent['jetPhi'] = self.data['jets'].phi[ievent]
-        
-        dataForEvent['nonMatchingJetPt'] = self.data['non_matching_jets'].pt[ievent]
-        dataForEvent['nonMatchingJetEta'] = self.data['non_matching_jets'].eta[ievent]
-        dataForEvent['nonMatchingJetPhi'] = self.data['non_matching_jets'].phi[ievent]
+        return EventBatch(self.data, ievent, ievent+1, tablename=self.tablename, pfTypes=self.pfTypes)[0]
 
-        self.tablename = 'eventImage' if not self.jetsOnly else 'jetImage'
+    def make_plots(self, start, stop):
+        '''Plot the 2D eta/phi maps for events in the range [start, stop).'''
+        batch = EventBatch(self.data, start, stop, tablename=self.tablename, pfTypes=self.pfTypes)
+        for i in range(len(batch)):
+            self.make_plot(start+i, dataForEvent=batch[i])
 
-        dataForEvent[f'{self.tablename}_pixels'] = self.data[f'{self.tablename}_pixels'][ievent]
-        dataForEvent[f'{self.tablename}_nEta'] = self.data[f'{self.tablename}_nEta'][ievent]
-        dataForEvent[f'{self.tablename}_nPhi'] = self.data[f'{self.tablename}_nPhi'][ievent]
-        
-        return dataForEvent
-
-    def make_plot(self, ievent):
-        '''Plot the 2D eta/phi map for event # ievent.'''
-        # Get the data for this particular event
-        dataForEvent = self._get_data_for_event(ievent)
-
-        # Reshape the pixels into 2D format
-        pixels_2d = np.reshape(dataForEvent[f'{self.tablename}_pixels'], (dataForEvent[f'{self.tablename}_nEta'], dataForEvent[f'{self.tablename}_nPhi']))
-
-        fig, ax = self.make_cmesh_plot(
-            dataForEvent[f'{self.tablename}_nEta'], 
-            dataForEvent[f'{self.tablename}_nPhi'], 
-            pixels_2d,
-            title=self._get_dataset_tag(self.datasetName)
-            )
-        
-        ax.text(0,1,f'ievent={ievent}',
-                fontsize=12,
-                ha='left',
-                va='bottom',
-                transform=ax.transAxes
-            )
-    
-        ax.text(1,1,self.pfType,
-            fontsize=12,
-            ha='right',
-            va='bottom',
-            transform=ax.transAxes
-            )
-    
+    def _draw_jets(self, ax, dataForEvent, annotate=True, legend=True):
+        '''Draw the jet positions with R=0.4 circles around them.'''
         scatter_opts = {
             'marker' : 'x',
             'color' : "black",
@@ -131,16 +150,17 @@ class Plot2DMaker(ColormeshPlotter):
             **scatter_opts
             )
 
-        for iJet in range(len(dataForEvent['jetEta'])):
-            loc = (dataForEvent['jetEta'][iJet], dataForEvent['jetPhi'][iJet])
-            text = f'$p_T = {dataForEvent["jetPt"][iJet]:.2f} \\ GeV$'
+        if annotate:
+            for iJet in range(len(dataForEvent['jetEta'])):
+                loc = (dataForEvent['jetEta'][iJet], dataForEvent['jetPhi'][iJet])
+                text = f'$p_T = {dataForEvent["jetPt"][iJet]:.2f} \\ GeV$'
 
-            if loc[1] > 0:
-                xytext = (loc[0], loc[1]-0.5)
-            else:
-                xytext = (loc[0], loc[1]+0.5)
+                if loc[1] > 0:
+                    xytext = (loc[0], loc[1]-0.5)
+                else:
+                    xytext = (loc[0], loc[1]+0.5)
 
-            ax.annotate(text, loc, xytext=xytext, horizontalalignment='center')
+                ax.annotate(text, loc, xytext=xytext, horizontalalignment='center')
 
         # Also plot the non-matching jets
         scatter_opts['color'] = 'red'
@@ -151,7 +171,8 @@ class Plot2DMaker(ColormeshPlotter):
             **scatter_opts
             )
 
-        ax.legend()
+        if legend:
+            ax.legend()
 
         # Draw a circle with R=0.4 around each jet
         circle_opts = {
@@ -173,48 +194,190 @@ class Plot2DMaker(ColormeshPlotter):
 
         ax.set_ylim(-np.pi, np.pi)
 
-        outfilename = f'{self.datasetName}_ievent_{ievent}_{self.pfType}.pdf'
+    def make_plot(self, ievent, dataForEvent=None):
+        '''Plot the 2D eta/phi map for event # ievent.'''
+        # Get the data for this particular event, unless it is passed from a batch
+        if dataForEvent is None:
+            dataForEvent = self._get_data_for_event(ievent)
+
+        pixels_2d = dataForEvent['pixels'][0]
+
+        fig, ax = self.make_cmesh_plot(
+            pixels_2d.shape[0], 
+            pixels_2d.shape[1], 
+            pixels_2d,
+            title=self._get_dataset_tag(self.datasetName)
+            )
+        
+        ax.text(0,1,f'ievent={ievent+self.eventOffset}',
+                fontsize=12,
+                ha='left',
+                va='bottom',
+                transform=ax.transAxes
+            )
+    
+        ax.text(1,1,self.pfType,
+            fontsize=12,
+            ha='right',
+            va='bottom',
+            transform=ax.transAxes
+            )
+    
+        self._draw_jets(ax, dataForEvent)
+
+        outfilename = f'{self.datasetName}_ievent_{ievent+self.eventOffset}_{self.pfType}.pdf'
+        PlotSaver(fig, self.tag, self.jetsOnly).save(outfilename)
+
+class MultiChannelPlotMaker(Plot2DMaker):
+    def __init__(self, data, tag, datasetName, pfTypes=['all'], jetsOnly=False, eventOffset=0) -> None:
+        '''
+        Plot the images of several PF candidate types for each event as panels of one figure,
+        with shared axes, jet markers and colour scale. Each event is read only once.
+        '''
+        super().__init__(data, tag, datasetName, pfType='multichannel', jetsOnly=jetsOnly, eventOffset=eventOffset)
+        self.pfTypes = pfTypes
+
+    def make_plot(self, ievent, dataForEvent=None):
+        '''Plot the 2D eta/phi maps of all channels for event # ievent.'''
+        if dataForEvent is None:
+            dataForEvent = self._get_data_for_event(ievent)
+
+        pixels = dataForEvent['pixels']
+        numChannels = len(self.pfTypes)
+        ncols = min(numChannels, 3)
+        nrows = int(np.ceil(numChannels / ncols))
+
+        fig, axes = plt.subplots(nrows, ncols, 
+            sharex=True, 
+            sharey=True, 
+            squeeze=False, 
+            figsize=(5*ncols, 4*nrows)
+            )
+        axes = axes.flatten()
+
+        for ichannel, pfType in enumerate(self.pfTypes):
+            ax = axes[ichannel]
+            cmap = self.draw_cmesh(ax, pixels.shape[1], pixels.shape[2], pixels[ichannel])
+            ax.set_title(pfType)
+            # Only annotate jet pts and draw the legend on the first panel
+            self._draw_jets(ax, dataForEvent, annotate=ichannel == 0, legend=ichannel == 0)
+
+        for ax in axes[numChannels:]:
+            ax.remove()
+        for ax in axes[:numChannels]:
+            if ax.get_subplotspec().is_last_row():
+                ax.set_xlabel(r'PF Candidate $\eta$')
+            if ax.get_subplotspec().is_first_col():
+                ax.set_ylabel(r'PF Candidate $\phi$')
+
+        cb = fig.colorbar(cmap, ax=list(axes[:numChannels]))
+        cb.set_label('PF Energy (GeV)')
+
+        fig.suptitle(f'{self._get_dataset_tag(self.datasetName)}, ievent={ievent+self.eventOffset}')
+
+        outfilename = f'{self.datasetName}_ievent_{ievent+self.eventOffset}_{self.pfType}.pdf'
         PlotSaver(fig, self.tag, self.jetsOnly).save(outfilename)
 
 class RatioPlotMaker():
-    def __init__(self, dfs, tag, pfType='all', jetsOnly=False) -> None:
+    def __init__(self, datas, tag, pfType='all', jetsOnly=False, pairs=None, eventOffset=0) -> None:
         '''
         Plot the ratio of two event images for two different scenarios.
         (e.g. different cleaning cuts applied)
+        datas holds the masked data of the two scenarios, see RootFile.get_masked_candidates().
+        pairs holds the matched event indices in the two datasets (see EventAligner);
+        by default, event # ievent is assumed to be the same physics event in both.
+        eventOffset is added to the event numbers in the plot labels and file names.
         '''
-        self.dfs = dfs
+        self.datas = datas
         self.tag = tag
         # Type of PF candidate collection for the event image
         self.pfType = pfType
         # Only read the collection of PF candidates coming from jets?
         self.jetsOnly = jetsOnly
-        self.tablename = "JetImage" if self.jetsOnly else "EventImage"
+        self.tablename = "jetImage" if self.jetsOnly else "eventImage"
+        self.eventOffset = eventOffset
 
-        self._read_data()
+        if pairs is None:
+            numevents = min(len(self.datas[0][f'{self.tablename}_nEta']), len(self.datas[1][f'{self.tablename}_nEta']))
+            pairs = (np.arange(numevents), np.arange(numevents))
+        self.pairs = pairs
 
-    def _read_data(self):
-        branchname = f"{self.tablename}_{self.pfType}Pixels" if self.pfType != 'all' else f"{self.tablename}_pixels"
+        self._check_data()
 
+    def _check_data(self):
         # Assert that the two images are of the same size
-        assert (self.dfs[0][f'{self.tablename}Size_nEtaBins'] == self.dfs[1][f'{self.tablename}Size_nEtaBins']).all()
-        assert (self.dfs[0][f'{self.tablename}Size_nPhiBins'] == self.dfs[1][f'{self.tablename}Size_nPhiBins']).all()
-        
-        self.data = {
-            'pixels0' : self.dfs[0][branchname],
-            'pixels1' : self.dfs[1][branchname],
-            'etaSize' : self.dfs[0][f'{self.tablename}Size_nEtaBins'],
-            'phiSize' : self.dfs[0][f'{self.tablename}Size_nPhiBins'],
-        }
-    
-    def make_ratio_plot(self, ievent):
-        dataForEvent = {k: v[ievent] for k,v in self.data.items()}
+        for dimension in ['nEta', 'nPhi']:
+            sizes0 = np.asarray(self.datas[0][f'{self.tablename}_{dimension}'])[self.pairs[0]]
+            sizes1 = np.asarray(self.datas[1][f'{self.tablename}_{dimension}'])[self.pairs[1]]
+            assert (sizes0 == sizes1).all()
+
+    def _get_images(self, idata, start, stop):
+        '''(nEvents, nEta, nPhi) float64 images of the matched events # start to stop.'''
+        entries = self.pairs[idata][start:stop]
+        return stack_channels(self.datas[idata], [self.pfType], tablename=self.tablename, entries=entries)[:,0]
+
+    def _get_pixels(self, idata, ievent):
+        '''Pixels of matched event # ievent in float64, decoded from the storage format.'''
+        return self._get_images(idata, ievent, ievent+1)[0]
+
+    def compute_summed_images(self, batchsize=1000) -> tuple:
+        '''Sum the images of all matched events in both datasets, batch by batch.'''
+        if len(self.pairs[0]) == 0:
+            raise ValueError(f'No matched events between the two datasets, see ./output/{self.tag}/alignment_report.txt')
+        sums = None
+        for start in range(0, len(self.pairs[0]), batchsize):
+            images = [self._get_images(idata, start, start+batchsize).sum(axis=0) for idata in range(2)]
+            sums = images if sums is None else [sums[idata] + images[idata] for idata in range(2)]
+        return sums
+
+    def _plot_summed(self, values, label, outfilename, **kwargs):
+        etabins = np.linspace(-5, 5, values.shape[0])
+        phibins = np.linspace(-np.pi, np.pi, values.shape[1])
+
+        fig, ax = plt.subplots()
+        cmap = ax.pcolormesh(etabins, phibins, values.T, **kwargs)
+        cb = fig.colorbar(cmap, ax=ax)
+        cb.set_label(label)
+
+        ax.set_xlabel('PF Candidate $\\eta$')
+        ax.set_ylabel('PF Candidate $\\phi$')
 
-        imshape = (dataForEvent['etaSize'], dataForEvent['phiSize'])
-        pixels0_2d = np.reshape(dataForEvent['pixels0'], imshape)
-        pixels1_2d = np.reshape(dataForEvent['pixels1'], imshape)
+        ax.text(0,1,f'{len(self.pairs[0])} matched events',
+                fontsize=14,
+                ha='left',
+                va='bottom',
+                transform=ax.transAxes
+            )
+
+        ax.text(1,1,self.pfType,
+            fontsize=14,
+            ha='right',
+            va='bottom',
+            transform=ax.transAxes
+            )
+
+        PlotSaver(fig, self.tag, self.jetsOnly).save(outfilename)
 
-        etabins = np.linspace(-5, 5, dataForEvent['etaSize'])
-        phibins = np.linspace(-np.pi, np.pi, dataForEvent['phiSize'])
+    def make_summary_plot(self, batchsize=1000):
+        '''Plot the ratio and the difference of the images summed over all matched events.'''
+        sum0, sum1 = self.compute_summed_images(batchsize=batchsize)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = sum0 / sum1
+        self._plot_summed(ratio, 'Ratio of summed PF Energies', f'summed_ratio_{self.pfType}.pdf')
+
+        # Symmetric colour scale, so that no difference is the middle of the colour map
+        difference = sum0 - sum1
+        vmax = max(np.abs(difference).max(), 1e-6)
+        self._plot_summed(difference, 'Difference of summed PF Energies (GeV)', f'summed_difference_{self.pfType}.pdf',
+            cmap='coolwarm', vmin=-vmax, vmax=vmax)
+
+    def make_ratio_plot(self, ievent):
+        pixels0_2d = self._get_pixels(0, ievent)
+        pixels1_2d = self._get_pixels(1, ievent)
+
+        etabins = np.linspace(-5, 5, pixels0_2d.shape[0])
+        phibins = np.linspace(-np.pi, np.pi, pixels0_2d.shape[1])
 
         # Take the ratio and plot!
         ratio = pixels0_2d / pixels1_2d
@@ -227,7 +390,7 @@ class RatioPlotMaker():
         ax.set_xlabel('PF Candidate $\\eta$')
         ax.set_ylabel('PF Candidate $\\phi$')
         
-        ax.text(0,1,f'ievent={ievent}',
+        ax.text(0,1,f'ievent={ievent+self.eventOffset}',
                 fontsize=14,
                 ha='left',
                 va='bottom',
@@ -241,50 +404,40 @@ class RatioPlotMaker():
             transform=ax.transAxes
             )
     
-        outfilename = f'ievent_{ievent}_ratio_{self.pfType}.pdf'
+        outfilename = f'ievent_{ievent+self.eventOffset}_ratio_{self.pfType}.pdf'
         PlotSaver(fig, self.tag, self.jetsOnly).save(outfilename)
 
 class AccumulationPlotMaker(ColormeshPlotter):
-    def __init__(self, df, tag, dataset) -> None:
+    def __init__(self, data, tag, dataset) -> None:
+        '''
+        Plot the average image of a set of events.
+        data is the masked data, see RootFile.get_masked_candidates().
+        '''
         super().__init__()
-        self.df = df
+        self.data = data
         self.tag = tag
         self.dataset = dataset
 
-        self._read_data()
-
-        # Start with zero accumulator
-        temp = self.data['pixels'].iloc[0]
-
-        self.etaSize = self.data['etaSize'].iloc[0]
-        self.phiSize = self.data['phiSize'].iloc[0]
-        temp = np.reshape(temp, (self.etaSize, self.phiSize))
+        self.etaSize, self.phiSize = get_image_shape(self.data['eventImage_nEta'], self.data['eventImage_nPhi'])
 
-        self.accumulator = np.zeros_like(temp)
+        # Start with zero accumulator, always accumulate in float64
+        self.accumulator = np.zeros((self.etaSize, self.phiSize), dtype=np.float64)
 
-    def _read_data(self):
-        self.data = {
-            'pixels' : self.df['EventImage_pixels'],
-            'etaSize' : self.df['EventImageSize_nEtaBins'],
-            'phiSize' : self.df['EventImageSize_nPhiBins'],
-        }
-
-    def make_acc_plot(self, numevents=20):
+    def make_acc_plot(self, numevents=20, batchsize=1000):
         '''Make an image plot by accumulating numevents # of event images.'''
-        for ievent in range(numevents):
-            try:
-                pixels = self.data['pixels'].iloc[ievent]
-            except IndexError:
-                print('Ran out of events, breaking out of loop.')
-                print(f'Event: {ievent}')
-                break
-            
-            # Reshape pixels
-            pixels = np.reshape(pixels, (self.etaSize, self.phiSize))
-            self.accumulator += pixels
+        numavailable = len(self.data['eventImage_pixels'])
+        if numevents > numavailable:
+            print('Ran out of events, breaking out of loop.')
+            print(f'Event: {numavailable}')
+            numevents = numavailable
+
+        # Decode and sum the images batch by batch
+        for start in range(0, numevents, batchsize):
+            pixels = stack_channels(self.data, ['all'], start=start, stop=min(start+batchsize, numevents))
+            self.accumulator += pixels[:,0].sum(axis=0, dtype=np.float64)
 
         # Normalize to number of events we ran
-        self.accumulator /= (ievent+1)
+        self.accumulator /= numevents
         
         fig, ax = self.make_cmesh_plot(self.etaSize, 
             self.phiSize, 
@@ -292,11 +445,11 @@ class AccumulationPlotMaker(ColormeshPlotter):
             title=self.dataset
             )
 
-        ax.text(1,0,f'{ievent+1} events',
+        ax.text(1,0,f'{numevents} events',
             ha='right',
             va='bottom',
             transform=ax.transAxes
         )
 
         outfilename=f'accumulated_{self.dataset}.pdf'
-        PlotSaver(fig, self.tag).save(outfilename)
\ No newline at end of file
+        PlotSaver(fig, self.tag).save(outfilename)
@@ -0,0 +1,80 @@
+import os
+import threading
+import uproot
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .memory import parse_size
+
+class ReadOptions():
+    # Shared by all readers which are not given options explicitly
+    _default = None
+
+    def __init__(self, numThreads=None, basketCacheBytes=64*1024**2) -> None:
+        '''
+        Options to read the ROOT files with.
+        Baskets are decompressed and interpreted in a pool of numThreads threads, one per core
+        by default (uproot uses the same executor for both). With numThreads=1, they are read
+        in the calling thread. Decompressed baskets are kept in a cache of basketCacheBytes,
+        shared by all reads made with these options, 0 disables the cache.
+        '''
+        self.numThreads = numThreads if numThreads else (os.cpu_count() or 1)
+        self.basketCacheBytes = basketCacheBytes
+        self._executor = None
+        self._basketcache = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default():
+        if ReadOptions._default is None:
+            ReadOptions._default = ReadOptions()
+        return ReadOptions._default
+
+    def for_workers(self, workers):
+        '''Options for each of workers processes, which share the cores between them.'''
+        if workers <= 1:
+            return self
+        numThreads = max(1, min(self.numThreads, (os.cpu_count() or 1) // workers))
+        return ReadOptions(numThreads=numThreads, basketCacheBytes=self.basketCacheBytes)
+
+    @property
+    def executor(self):
+        if self.numThreads <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.numThreads)
+            return self._executor
+
+    @property
+    def basketcache(self):
+        if self.basketCacheBytes <= 0:
+            return None
+        with self._lock:
+            if self._basketcache is None:
+                self._basketcache = uproot.cache.ThreadSafeArrayCache(self.basketCacheBytes)
+            return self._basketcache
+
+    @property
+    def kwargs(self) -> dict:
+        '''Keyword arguments for uproot's arrays() and iterate() calls.'''
+        return {'executor' : self.executor, 'basketcache' : self.basketcache}
+
+    def __getstate__(self):
+        # The thread pool and the cache stay in their process, workers make their own
+        return {'numThreads' : self.numThreads, 'basketCacheBytes' : self.basketCacheBytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self) -> str:
+        return f'ReadOptions(numThreads={self.numThreads}, basketCacheBytes={self.basketCacheBytes})'
+
+def add_read_arguments(parser) -> None:
+    '''Add the --readThreads and --basketCache options to a script's argument parser.'''
+    parser.add_argument('--readThreads', type=int, help='Number of threads to decompress and interpret the baskets with, one per core by default.', default=None)
+    parser.add_argument('--basketCache', type=parse_size, help='Size of the cache of decompressed baskets (e.g. 256MB), 0 to disable it.', default='64MB')
+
+def get_read_options(args) -> ReadOptions:
+    '''Read options from the arguments added with add_read_arguments().'''
+    return ReadOptions(numThreads=args.readThreads, basketCacheBytes=args.basketCache)
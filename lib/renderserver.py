@@ -0,0 +1,234 @@
+import json
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .alignment import EventAligner
+from .fastrender import FastImageRenderer
+from .imagetools import stack_channels
+from .pipeline import prepare_masked_data
+from .plotmaker import EventBatch
+from .rootfile import RootFile
+
+class LRUCache():
+    def __init__(self, maxBytes=256*1024**2) -> None:
+        '''Thread-safe least-recently-used cache of rendered outputs, bounded in total size.'''
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            if key in self._items:
+                self.numBytes -= len(self._items.pop(key))
+            self._items[key] = value
+            self.numBytes += len(value)
+            while self.numBytes > self.maxBytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.numBytes -= len(evicted)
+
+class RenderService():
+    def __init__(self, datasets, cacheBytes=256*1024**2, numPrefetch=2, imageStorage='float32', scale=4, readOptions=None) -> None:
+        '''
+        Keep the data of the given datasets (name -> ROOT file path) loaded, and render
+        event images, ratio maps and accumulated maps to PNG on request.
+        Rendered outputs are kept in an LRU cache, and the numPrefetch events on each side
+        of a requested event are rendered in the background.
+        Datasets are loaded outside the shared lock, so that loading one does not block
+        requests for the others.
+        '''
+        self.datasets = datasets
+        self.imageStorage = imageStorage
+        self.readOptions = readOptions
+        self.numPrefetch = numPrefetch
+        self.cache = LRUCache(cacheBytes)
+
+        self.renderer = FastImageRenderer(scale=scale)
+        self.ratioRenderer = FastImageRenderer(scale=scale, vmin=0., vmax=2., cmap='coolwarm', log=False)
+
+        self._data = {}
+        self._aligners = {}
+        self._lock = threading.Lock()
+        # One lock per dataset, held while it is loaded
+        self._loadLocks = {}
+        # Keys of the prefetch renders queued or in flight, at most maxPending at once
+        self._pending = set()
+        self.maxPending = 4 * max(numPrefetch, 1)
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    def get_data(self, dataset):
+        '''Masked data of a dataset, read from the ROOT file on first use.'''
+        if dataset not in self.datasets:
+            raise KeyError(f'Unknown dataset: {dataset}')
+        with self._lock:
+            if dataset in self._data:
+                return self._data[dataset]
+            loadLock = self._loadLocks.setdefault(dataset, threading.Lock())
+
+        # Only the requests for this dataset wait for it to be loaded
+        with loadLock:
+            with self._lock:
+                if dataset in self._data:
+                    return self._data[dataset]
+            rootfile = RootFile(self.datasets[dataset], imageStorage=self.imageStorage, readOptions=self.readOptions)
+            data = prepare_masked_data(rootfile)
+            with self._lock:
+                self._data[dataset] = data
+            return data
+
+    def describe(self) -> dict:
+        '''Number of events of each dataset, None if it is not loaded yet.'''
+        with self._lock:
+            return {name : len(self._data[name]['jets']) if name in self._data else None for name in self.datasets}
+
+    def get_aligner(self, dataset0, dataset1):
+        data0, data1 = self.get_data(dataset0), self.get_data(dataset1)
+        with self._lock:
+            if (dataset0, dataset1) in self._aligners:
+                return self._aligners[(dataset0, dataset1)]
+        aligner = EventAligner.from_data(data0, data1)
+        with self._lock:
+            return self._aligners.setdefault((dataset0, dataset1), aligner)
+
+    def _cached(self, key, render):
+        png = self.cache.get(key)
+        if png is None:
+            png = render()
+            self.cache.put(key, png)
+        return png
+
+    def _render_pending(self, key, render) -> None:
+        try:
+            self._cached(key, render)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _prefetch(self, keyfunc, renderfunc, ievent, numevents) -> None:
+        '''
+        Render the neighbouring events in the background, unless they are cached or already queued.
+        Nothing more is queued while maxPending renders are waiting, e.g. when browsing quickly.
+        '''
+        for offset in range(1, self.numPrefetch+1):
+            for neighbour in [ievent+offset, ievent-offset]:
+                if not 0 <= neighbour < numevents:
+                    continue
+                key = keyfunc(neighbour)
+                with self._lock:
+                    if key in self._pending or key in self.cache or len(self._pending) >= self.maxPending:
+                        continue
+                    self._pending.add(key)
+                self._executor.submit(self._render_pending, key, lambda n=neighbour: renderfunc(n))
+
+    def render_event(self, dataset, ievent, pfType='all') -> bytes:
+        data = self.get_data(dataset)
+        numevents = len(data['jets'])
+        if not 0 <= ievent < numevents:
+            raise IndexError(f'Event {ievent} out of range for {dataset} ({numevents} events)')
+
+        def render(i):
+            dataForEvent = EventBatch(data, i, i+1, pfTypes=[pfType])[0]
+            return self.renderer.render_png(dataForEvent['pixels'][0], dataForEvent)
+
+        keyfunc = lambda i: ('event', dataset, i, pfType)
+        png = self._cached(keyfunc(ievent), lambda: render(ievent))
+        self._prefetch(keyfunc, render, ievent, numevents)
+        return png
+
+    def render_ratio(self, dataset0, dataset1, ievent, pfType='all') -> bytes:
+        aligner = self.get_aligner(dataset0, dataset1)
+        datas = [self.get_data(dataset0), self.get_data(dataset1)]
+        if not 0 <= ievent < len(aligner):
+            raise IndexError(f'Matched event {ievent} out of range ({len(aligner)} matched events)')
+
+        def render(i):
+            images = [stack_channels(data, [pfType], entries=entries[i:i+1])[0,0] for data, entries in zip(datas, aligner.pairs)]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self.ratioRenderer.render_png(images[0] / images[1])
+
+        keyfunc = lambda i: ('ratio', dataset0, dataset1, i, pfType)
+        png = self._cached(keyfunc(ievent), lambda: render(ievent))
+        self._prefetch(keyfunc, render, ievent, len(aligner))
+        return png
+
+    def render_accumulated(self, dataset, numevents=1000, pfType='all', batchsize=1000) -> bytes:
+        if numevents < 1:
+            raise ValueError(f'Number of events to accumulate must be positive, got {numevents}')
+        data = self.get_data(dataset)
+        numevents = min(numevents, len(data['jets']))
+        if numevents == 0:
+            raise ValueError(f'No events passing the selection in {dataset}')
+
+        def render():
+            accumulator = None
+            for start in range(0, numevents, batchsize):
+                images = stack_channels(data, [pfType], start=start, stop=min(start+batchsize, numevents))
+                summed = images[:,0].sum(axis=0, dtype=np.float64)
+                accumulator = summed if accumulator is None else accumulator + summed
+            return self.renderer.render_png(accumulator / numevents)
+
+        return self._cached(('accumulated', dataset, numevents, pfType), render)
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    # Set by make_server()
+    service = None
+
+    def _send(self, code, body, contentType):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        pfType = params.get('pfType', 'all')
+        try:
+            if url.path == '/':
+                body = json.dumps(self.service.describe()).encode('utf-8')
+                self._send(200, body, 'application/json')
+                return
+            elif url.path == '/event':
+                png = self.service.render_event(params['dataset'], int(params['ievent']), pfType)
+            elif url.path == '/ratio':
+                png = self.service.render_ratio(params['dataset0'], params['dataset1'], int(params['ievent']), pfType)
+            elif url.path == '/accumulated':
+                png = self.service.render_accumulated(params['dataset'], int(params.get('numevents', 1000)), pfType)
+            else:
+                self._send(404, b'Unknown endpoint\n', 'text/plain')
+                return
+        except KeyError as e:
+            self._send(404 if 'Unknown' in str(e) else 400, f'{e}\n'.encode('utf-8'), 'text/plain')
+            return
+        except (IndexError, ValueError) as e:
+            self._send(400, f'{e}\n'.encode('utf-8'), 'text/plain')
+            return
+        except Exception as e:
+            # Read or render failures: answer the client and keep the server running
+            self.log_error('Error serving %s: %r', self.path, e)
+            self._send(500, f'Internal error: {e}\n'.encode('utf-8'), 'text/plain')
+            return
+
+        self._send(200, png, 'image/png')
+
+def make_server(service, port=8050):
+    '''HTTP server for the render service, only listening on localhost.'''
+    handler = type('Handler', (RenderRequestHandler,), {'service' : service})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
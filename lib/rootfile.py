@@ -1,11 +1,25 @@
 import os
 import uproot
+import awkward
+import numpy as np
 import pandas as pd
 
 from coffea.processor.dataframe import LazyDataFrame
 from coffea.analysis_objects import JaggedCandidateArray
 
 from .vbfmask import VBFMask
+from .imagestorage import get_image_codec
+from .memory import IMAGE_BRANCHES, get_rss_bytes
+from .readoptions import ReadOptions
+
+# Attribute names of the event image collection for each PF candidate type
+PF_TYPE_ATTRIBUTES = {
+    'all' : 'pixels',
+    'ChargedHadron' : 'chargedHadronPixels',
+    'NeutralHadron' : 'neutralHadronPixels',
+    'HFEM' : 'hfEMPixels',
+    'HFHadronic' : 'hfHardonicPixels',
+}
 
 class RootFile():
     def __init__(self, inpath, branches=[
@@ -15,13 +29,66 @@ class RootFile():
         "*GenJet*",
         "JetIm*", 
         "MET_*", 
-        "EventIm*"]) -> None:
+        "EventIm*"], entrystart=None, entrystop=None, imageStorage='float64', readOptions=None) -> None:
         
+        self.inpath = inpath
         self.infile = uproot.open(inpath)
         self.branches = branches
+        # Entry range to read, the whole tree by default
+        self.entrystart = entrystart
+        self.entrystop = entrystop
+        # Storage mode of the image pixels in memory (float64, float32, float16, log8, log16)
+        self.imageCodec = get_image_codec(imageStorage)
+        # Thread pool and basket cache to read with
+        self.readOptions = readOptions if readOptions is not None else ReadOptions.default()
+
+        self.df = LazyDataFrame(self.infile['Events'], entrystart=entrystart, entrystop=entrystop, flatten=True)
+        self._preload_images(self.infile['Events'], self.df)
+        self._setup_candidates(self.df)
 
-        df = LazyDataFrame(self.infile['Events'], flatten=True)
-        self._setup_candidates(df)
+    @staticmethod
+    def iterate(inpath, chunksize=10000, memoryBudget=None, **kwargs):
+        '''
+        Yield RootFile objects for consecutive chunks of chunksize entries.
+        If a MemoryBudget is given, it sets the size of each chunk instead, and is updated
+        with the RSS growth measured while each chunk is read.
+        '''
+        numentries = uproot.open(inpath)['Events'].numentries
+        entrystart = 0
+        while entrystart < numentries:
+            if memoryBudget is not None:
+                chunksize = memoryBudget.get_chunksize()
+            entrystop = min(entrystart+chunksize, numentries)
+
+            rssBefore = get_rss_bytes()
+            rootfile = RootFile(inpath, 
+                entrystart=entrystart, 
+                entrystop=entrystop, 
+                **kwargs
+                )
+            if memoryBudget is not None:
+                memoryBudget.observe(entrystop - entrystart, get_rss_bytes() - rssBefore)
+
+            yield rootfile
+            # Do not keep the previous chunk alive while reading the next one
+            del rootfile
+            entrystart = entrystop
+
+    def _preload_images(self, tree, df):
+        '''
+        Read the image branches in parallel with the read options, and hand them to the dataframe
+        encoded with the image codec. Branches are read and encoded one at a time, so that at most
+        one branch is held in full precision. The remaining (small) branches are still read lazily.
+        '''
+        for name in IMAGE_BRANCHES:
+            array = tree[name].array(
+                entrystart=self.entrystart,
+                entrystop=self.entrystop,
+                **self.readOptions.kwargs
+                )
+            # Same as what the dataframe returns with flatten=True
+            pixels = array.flatten() if isinstance(array, awkward.JaggedArray) else array
+            df[name] = self.imageCodec.encode(pixels)
 
     def _setup_candidates(self,df):
         self.genJets = JaggedCandidateArray.candidatesfromcounts(
@@ -40,13 +107,15 @@ class RootFile():
             mass=df['Jet_mass'],
         )
         
-        # 2D eta/phi event images, store dummy four momenta
+        # 2D eta/phi event images, store dummy four momenta.
+        # The four components share a single zero array, the pixels are already encoded.
+        dummy = np.zeros(len(df['EventImage_pixelsAfterPUPPI']), dtype=np.float32)
         self.eventImages = JaggedCandidateArray.candidatesfromcounts(
             df['nEventImage'],
-            pt=df['EventImage_pixelsAfterPUPPI']*0.,
-            eta=df['EventImage_pixelsAfterPUPPI']*0.,
-            phi=df['EventImage_pixelsAfterPUPPI']*0.,
-            mass=df['EventImage_pixelsAfterPUPPI']*0.,
+            pt=dummy,
+            eta=dummy,
+            phi=dummy,
+            mass=dummy,
             pixels=df['EventImage_pixelsAfterPUPPI'],
             hfHardonicPixels=df['EventImage_HFHadronicPixels'],
             hfEMPixels=df['EventImage_HFEMPixels'],
@@ -57,18 +126,22 @@ class RootFile():
         self.eventImageSizeEta = df['EventImageSize_nEtaBins']
         self.eventImageSizePhi = df['EventImageSize_nPhiBins']
 
+        dummy = np.zeros(len(df['JetImage_pixels']), dtype=np.float32)
         self.jetImages = JaggedCandidateArray.candidatesfromcounts(
             df['nJetImage'],
-            pt=df['JetImage_pixels']*0.,
-            eta=df['JetImage_pixels']*0.,
-            phi=df['JetImage_pixels']*0.,
-            mass=df['JetImage_pixels']*0.,
+            pt=dummy,
+            eta=dummy,
+            phi=dummy,
+            mass=dummy,
             pixels=df['JetImage_pixels'],
         )
 
         self.jetImageSizeEta = df['JetImageSize_nEtaBins']
         self.jetImageSizePhi = df['JetImageSize_nPhiBins']
 
+        # Event identifiers, to match events across files
+        self.eventKeys = {key : df[key] for key in ['run', 'luminosityBlock', 'event']}
+
     @property
     def dataframe(self):
         return self.df
@@ -89,7 +162,7 @@ class RootFile():
         '''
         mask = VBFMask(self.jets).evaluate_mask()
 
-        return {
+        masked_data = {
             'jets' : self.jets[mask],
             'genJets' : self.genJets[mask],
             'eventImage_pixels' : self.eventImages.pixels[mask],
@@ -98,4 +171,17 @@ class RootFile():
             'jetImage_pixels' : self.jetImages.pixels[mask],
             'jetImage_nEta' : self.jetImageSizeEta[mask],
             'jetImage_nPhi' : self.jetImageSizePhi[mask],
-        }
\ No newline at end of file
+            # Needed to decode the stored pixels
+            'imageCodec' : self.imageCodec,
+        }
+
+        for key, values in self.eventKeys.items():
+            masked_data[key] = values[mask]
+
+        # Filtered event images for each PF candidate type
+        for pfType, attribute in PF_TYPE_ATTRIBUTES.items():
+            if pfType == 'all':
+                continue
+            masked_data[f'eventImage_{pfType}Pixels'] = getattr(self.eventImages, attribute)[mask]
+
+        return masked_data
@@ -0,0 +1,136 @@
+import os
+import hashlib
+import uproot
+import numpy as np
+
+from coffea.analysis_objects import JaggedCandidateArray
+
+from .alignment import EVENT_KEY_DTYPE
+from .pipeline import prepare_masked_data
+from .readoptions import ReadOptions
+from .rootfile import RootFile
+from .vbfmask import VBFMask
+
+# Branches needed to evaluate the VBF cuts and identify the events, no images
+INDEX_BRANCHES = ['nJet', 'Jet_pt', 'Jet_eta', 'Jet_phi', 'Jet_mass', 'run', 'luminosityBlock', 'event']
+
+class SelectionIndex():
+    def __init__(self, entries, keys, source=None) -> None:
+        '''
+        Tree entry numbers of the events passing the VBF cuts, with their (run, luminosityBlock, event) keys.
+        Event # ievent of the masked data of the whole file is tree entry entries[ievent],
+        so a single event can be read without reading the rest of the file.
+        source holds the path, size and modification time of the indexed file, to detect stale indices.
+        '''
+        self.entries = np.asarray(entries, dtype=np.int64)
+        self.keys = keys
+        self.source = source
+
+    @staticmethod
+    def get_source(inpath) -> dict:
+        stat = os.stat(inpath)
+        return {'path' : os.path.abspath(inpath), 'size' : stat.st_size, 'mtime' : stat.st_mtime}
+
+    @staticmethod
+    def build(inpath, chunksize=100000, readOptions=None):
+        '''Build the index of a ROOT file, reading the jet and event number branches only.'''
+        readOptions = readOptions if readOptions is not None else ReadOptions.default()
+        tree = uproot.open(inpath)['Events']
+
+        entries, keys = [], []
+        chunks = tree.iterate(INDEX_BRANCHES, entrysteps=chunksize, namedecode='utf-8', reportentries=True, **readOptions.kwargs)
+        for entrystart, _, arrays in chunks:
+            jets = JaggedCandidateArray.candidatesfromcounts(
+                arrays['nJet'],
+                pt=arrays['Jet_pt'].flatten(),
+                eta=arrays['Jet_eta'].flatten(),
+                phi=arrays['Jet_phi'].flatten(),
+                mass=arrays['Jet_mass'].flatten(),
+            )
+            mask = np.asarray(VBFMask(jets).evaluate_mask())
+
+            entries.append(entrystart + np.flatnonzero(mask))
+            chunkKeys = np.empty(np.count_nonzero(mask), dtype=EVENT_KEY_DTYPE)
+            for name in EVENT_KEY_DTYPE.names:
+                chunkKeys[name] = np.asarray(arrays[name])[mask]
+            keys.append(chunkKeys)
+
+        return SelectionIndex(
+            np.concatenate(entries) if entries else np.zeros(0, dtype=np.int64),
+            np.concatenate(keys) if keys else np.zeros(0, dtype=EVENT_KEY_DTYPE),
+            SelectionIndex.get_source(inpath)
+            )
+
+    @staticmethod
+    def get_index_path(inpath, cachedir='./output/selection_index') -> str:
+        '''Path of the cached index of a ROOT file, unique per absolute input path.'''
+        pathHash = hashlib.md5(os.path.abspath(inpath).encode('utf-8')).hexdigest()[:8]
+        basename = os.path.basename(inpath).replace('.root', '')
+        return os.path.join(cachedir, f'{basename}_{pathHash}.npz')
+
+    @staticmethod
+    def load_or_build(inpath, cachedir='./output/selection_index', rebuild=False, **kwargs):
+        '''
+        Load the cached index of a ROOT file, or build and cache it if it does not exist yet,
+        or if the file changed since it was built.
+        '''
+        indexpath = SelectionIndex.get_index_path(inpath, cachedir)
+        if not rebuild and os.path.exists(indexpath):
+            index = SelectionIndex.load(indexpath)
+            if index.source == SelectionIndex.get_source(inpath):
+                return index
+
+        index = SelectionIndex.build(inpath, **kwargs)
+        index.save(indexpath)
+        return index
+
+    def save(self, outpath) -> None:
+        outdir = os.path.dirname(outpath)
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
+        np.savez(outpath,
+            entries=self.entries,
+            keys=self.keys,
+            sourcePath=np.array(self.source['path']),
+            sourceStat=np.array([self.source['size'], self.source['mtime']]),
+            )
+
+    @staticmethod
+    def load(inpath):
+        with np.load(inpath) as f:
+            size, mtime = f['sourceStat']
+            source = {'path' : str(f['sourcePath']), 'size' : int(size), 'mtime' : float(mtime)}
+            return SelectionIndex(f['entries'], f['keys'], source)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, ievent) -> int:
+        '''Tree entry number of post-selection event # ievent.'''
+        if not 0 <= ievent < len(self):
+            raise IndexError(f'Event {ievent} out of range ({len(self)} events pass the selection)')
+        return int(self.entries[ievent])
+
+    def find(self, run, luminosityBlock, event) -> int:
+        '''Post-selection event # of the event with the given key.'''
+        key = np.array((run, luminosityBlock, event), dtype=EVENT_KEY_DTYPE)
+        found = np.flatnonzero(self.keys == key)
+        if len(found) == 0:
+            raise KeyError(f'Event run={run} lumi={luminosityBlock} event={event} does not pass the selection or is not in the file')
+        return int(found[0])
+
+def parse_event_key(spec) -> tuple:
+    '''Parse a "run:lumi:event" string into a (run, luminosityBlock, event) tuple.'''
+    try:
+        run, luminosityBlock, event = (int(x) for x in spec.split(':'))
+    except ValueError:
+        raise ValueError(f'Invalid event key "{spec}", expected run:lumi:event')
+    return run, luminosityBlock, event
+
+def read_single_event(inpath, entry, genJetCleaning=True, **kwargs):
+    '''
+    Masked data holding the single event at the given tree entry, which must pass the selection.
+    Only the baskets containing that entry are read.
+    '''
+    rootfile = RootFile(inpath, entrystart=entry, entrystop=entry+1, **kwargs)
+    return prepare_masked_data(rootfile, genJetCleaning=genJetCleaning)
@@ -8,6 +8,8 @@ import numpy as np
 from datetime import datetime
 from lib.plotmaker import AccumulationPlotMaker
 from lib.rootfile import RootFile
+from lib.imagestorage import STORAGE_MODES
+from lib.readoptions import add_read_arguments, get_read_options
 
 pjoin = os.path.join
 
@@ -20,14 +22,16 @@ def parse_cli():
     parser.add_argument('inpath', help='Path to the first ROOT file.')
     parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_accumulated_run')
     parser.add_argument('--numevents', type=int, help='Number of events to accumulate.', default=40)
+    parser.add_argument('--imageStorage', help='Storage mode of the image pixels in memory.', choices=list(STORAGE_MODES), default='float64')
+    add_read_arguments(parser)
     args = parser.parse_args()
     return args
 
 def main():
     args = parse_cli()
-    masked_df = RootFile(args.inpath).get_masked_df()
+    masked_data = RootFile(args.inpath, imageStorage=args.imageStorage, readOptions=get_read_options(args)).get_masked_candidates()
 
-    plotter = AccumulationPlotMaker(masked_df, tag=args.tag, dataset=get_dataset_name(args.inpath))
+    plotter = AccumulationPlotMaker(masked_data, tag=args.tag, dataset=get_dataset_name(args.inpath))
     plotter.make_acc_plot(numevents=args.numevents)
 
 if __name__ == '__main__':
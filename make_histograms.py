@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import mplhep as hep
+
+from datetime import datetime
+from matplotlib import pyplot as plt
+from lib.histogrammer import fill_files, load_histograms, merge_histograms, parse_histogram_spec, save_histograms
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpaths', nargs='+', help='Paths to the input ROOT files, or to saved histogram files with --merge.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_histograms')
+    parser.add_argument('--hist', action='append', default=[], help='Histogram to fill, as name:expression:nbins:low:high. Can be given multiple times.')
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=100000)
+    parser.add_argument('--workers', type=int, help='Number of worker processes.', default=1)
+    parser.add_argument('--merge', action='store_true', help='Merge previously saved histogram files instead of filling.')
+    parser.add_argument('--outname', help='Name of the output histogram file.', default='histograms.npz')
+    parser.add_argument('--plot', action='store_true', help='Also plot the histograms.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def plot_histogram(histogram, outdir):
+    fig, ax = plt.subplots()
+    hep.histplot(histogram.counts, histogram.edges, ax=ax)
+
+    ax.set_ylabel('Counts')
+    ax.set_xlabel(histogram.name)
+
+    outpath = pjoin(outdir, f'{histogram.name}.pdf')
+    fig.savefig(outpath)
+    plt.close(fig)
+
+def main():
+    args = parse_cli()
+
+    if args.merge:
+        histograms = merge_histograms(map(load_histograms, args.inpaths))
+    else:
+        specs = [parse_histogram_spec(spec) for spec in args.hist]
+        histograms = fill_files(args.inpaths, specs, chunksize=args.chunksize, workers=args.workers, readOptions=get_read_options(args))
+
+    outdir = f'./output/{args.tag}'
+    save_histograms(pjoin(outdir, args.outname), histograms)
+
+    if args.plot:
+        for histogram in histograms.values():
+            plot_histogram(histogram, outdir)
+
+if __name__ == '__main__':
+    main()
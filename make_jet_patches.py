@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+
+from datetime import datetime
+from tqdm import tqdm
+from lib.jetpatches import iterate_jet_patches
+from lib.imagestorage import STORAGE_MODES, get_image_codec
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+def get_dataset_name(filename):
+    temp = os.path.basename(filename).replace('.root','').split('_')
+    return '_'.join(temp[1:])
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_jet_patches')
+    parser.add_argument('--patchSize', type=int, help='Size K of the KxK patches, in pixels.', default=32)
+    parser.add_argument('--pfTypes', nargs='+', help='PF candidate types to use as channels.', default=['all'])
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=10000)
+    parser.add_argument('--prefetchDepth', type=int, help='Number of chunks to read ahead in the background.', default=2)
+    parser.add_argument('--imageStorage', help='Storage mode of the pixels, in memory and in the output files.', choices=list(STORAGE_MODES), default='float64')
+    parser.add_argument('--noGenJetCleaning', action='store_true', help='Use all jets instead of the GEN-matched ones.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_cli()
+
+    outdir = f'./output/{args.tag}/jet_patches'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    dataset = get_dataset_name(args.inpath)
+
+    chunks = iterate_jet_patches(args.inpath,
+        patchSize=args.patchSize,
+        pfTypes=args.pfTypes,
+        chunksize=args.chunksize,
+        genJetCleaning=not args.noGenJetCleaning,
+        prefetchDepth=args.prefetchDepth,
+        imageStorage=args.imageStorage,
+        readOptions=get_read_options(args)
+        )
+
+    # Store the patches in the requested format, together with the parameters to decode them
+    codec = get_image_codec(args.imageStorage)
+    codecParams = {f'codec_{k}' : v for k, v in codec.params.items()}
+
+    for ichunk, chunk in enumerate(tqdm(chunks)):
+        chunk['patches'] = codec.encode(chunk['patches'])
+        outpath = pjoin(outdir, f'{dataset}_chunk{ichunk}.npz')
+        np.savez(outpath, pfTypes=np.array(args.pfTypes), **codecParams, **chunk)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+
+from datetime import datetime
+from matplotlib import pyplot as plt
+from lib.pixelsketch import PixelHistogramSketch, fill_sketch_files
+from lib.plotmaker import ColormeshPlotter
+from lib.readoptions import add_read_arguments, get_read_options
+
+pjoin = os.path.join
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpaths', nargs='+', help='Paths to the input ROOT files, or to saved sketches with --merge.')
+    parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_pixel_quantiles')
+    parser.add_argument('--pfTypes', nargs='+', help='PF candidate types to make the maps for.', default=['all'])
+    parser.add_argument('--quantiles', type=float, nargs='+', help='Quantiles to make the maps for.', default=[0.5, 0.99])
+    parser.add_argument('--numBins', type=int, help='Number of log bins per pixel.', default=64)
+    parser.add_argument('--vmin', type=float, help='Lowest pixel energy binned, below it a pixel counts as empty.', default=1e-2)
+    parser.add_argument('--vmax', type=float, help='Highest pixel energy binned.', default=1e4)
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=10000)
+    parser.add_argument('--prefetchDepth', type=int, help='Number of chunks to prepare ahead in the background.', default=2)
+    parser.add_argument('--workers', type=int, help='Number of processes to fill the files with.', default=1)
+    parser.add_argument('--merge', action='store_true', help='Merge saved sketches instead of reading ROOT files.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def plot_occupancy(etaSize, phiSize, occupancy, title, outpath):
+    fig, ax = plt.subplots()
+    etaBins = np.linspace(-5,5,etaSize)
+    phiBins = np.linspace(-np.pi,np.pi,phiSize)
+    cmap = ax.pcolormesh(etaBins, phiBins, occupancy.T, vmin=0, vmax=1)
+
+    ax.set_xlabel(r'PF Candidate $\eta$')
+    ax.set_ylabel(r'PF Candidate $\phi$')
+    ax.set_title(title)
+
+    cb = fig.colorbar(cmap, ax=ax)
+    cb.set_label('Fraction of events with energy')
+
+    fig.savefig(outpath)
+    plt.close(fig)
+
+def main():
+    args = parse_cli()
+
+    outdir = f'./output/{args.tag}/pixel_quantiles'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    if args.merge:
+        sketch = None
+        for inpath in args.inpaths:
+            loaded = PixelHistogramSketch.load(inpath)
+            sketch = loaded if sketch is None else sketch + loaded
+    else:
+        sketch = fill_sketch_files(args.inpaths,
+            workers=args.workers,
+            pfTypes=args.pfTypes,
+            chunksize=args.chunksize,
+            prefetchDepth=args.prefetchDepth,
+            vmin=args.vmin,
+            vmax=args.vmax,
+            numBins=args.numBins,
+            readOptions=get_read_options(args),
+            )
+        if sketch is None:
+            raise RuntimeError('No events passing the selection in the input files.')
+        sketch.save(pjoin(outdir, 'sketch.npz'))
+
+    if len(args.pfTypes) != sketch.shape[0]:
+        raise ValueError(f'{len(args.pfTypes)} PF types given for a sketch with {sketch.shape[0]} channels.')
+
+    _, etaSize, phiSize = sketch.shape
+    plotter = ColormeshPlotter()
+    quantileMaps = {q : sketch.quantile(q) for q in args.quantiles}
+    occupancy = sketch.occupancy()
+
+    for ichannel, pfType in enumerate(args.pfTypes):
+        for q, quantileMap in quantileMaps.items():
+            fig, ax = plotter.make_cmesh_plot(etaSize, phiSize, quantileMap[ichannel],
+                title=f'{pfType}: {q*100:g}% quantile, {sketch.numEvents} events'
+                )
+            fig.savefig(pjoin(outdir, f'{pfType}_quantile_{q*100:g}.pdf'))
+            plt.close(fig)
+
+        plot_occupancy(etaSize, phiSize, occupancy[ichannel],
+            title=f'{pfType}: occupancy, {sketch.numEvents} events',
+            outpath=pjoin(outdir, f'{pfType}_occupancy.pdf')
+            )
+
+if __name__ == '__main__':
+    main()
@@ -6,21 +6,90 @@ import argparse
 import numpy as np
 
 from datetime import datetime
+from lib.alignment import EventAligner
 from lib.plotmaker import RatioPlotMaker
 from lib.rootfile import RootFile
+from lib.imagestorage import STORAGE_MODES
+from lib.readoptions import add_read_arguments, get_read_options
+from lib.selectionindex import SelectionIndex, parse_event_key, read_single_event
 
 def parse_cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('inpath1', help='Path to the first ROOT file.')
     parser.add_argument('inpath2', help='Path to the second ROOT file.')
     parser.add_argument('--tag', help='Tag for the job.', default=f'{datetime.now().strftime("%Y-%m-%d")}_ratio_run')
-    parser.add_argument('--ievent', type=int, help='The event # to look at, default is the first event.', default=0)
+    parser.add_argument('--ievent', type=int, help='The (matched) event # to look at, default is the first event.', default=0)
+    parser.add_argument('--noAlign', action='store_true', help='Assume the events are in the same order in both files, instead of matching them by run/lumi/event.')
+    parser.add_argument('--summary', action='store_true', help='Also plot the ratio and the difference of the images summed over all matched events.')
+    parser.add_argument('--imageStorage', help='Storage mode of the image pixels in memory.', choices=list(STORAGE_MODES), default='float64')
+    parser.add_argument('--eventKey', type=parse_event_key, help='Look at the event with this run:lumi:event key instead of --ievent.', default=None)
+    parser.add_argument('--rebuildIndex', action='store_true', help='Rebuild the cached selection indices of the input files.')
+    add_read_arguments(parser)
     args = parser.parse_args()
+    if args.eventKey is not None and args.summary:
+        parser.error('--eventKey cannot be combined with --summary')
     return args
 
+def write_alignment_report(tag, aligner):
+    outdir = f'./output/{tag}'
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    with open(os.path.join(outdir, 'alignment_report.txt'), 'w+') as f:
+        f.write(aligner.report() + '\n')
+
+def load_all_events(args, readOptions):
+    '''Read the masked data of the whole files, needed for the summary plot.'''
+    masked_data1 = RootFile(args.inpath1, imageStorage=args.imageStorage, readOptions=readOptions).get_masked_candidates()
+    masked_data2 = RootFile(args.inpath2, imageStorage=args.imageStorage, readOptions=readOptions).get_masked_candidates()
+
+    # Match the events of the two files by run/lumi/event
+    pairs = None
+    if not args.noAlign:
+        aligner = EventAligner.from_data(masked_data1, masked_data2)
+        pairs = aligner.pairs
+        write_alignment_report(args.tag, aligner)
+        if len(aligner) == 0:
+            raise ValueError(f'No events in common between the two files, see ./output/{args.tag}/alignment_report.txt')
+
+    return [masked_data1, masked_data2], pairs, args.ievent, 0
+
+def load_single_event(args, readOptions):
+    '''
+    Read only the entries of the requested event in both files, found through the
+    selection indices of the files. The indices are built and cached on first use.
+    '''
+    indices = [
+        SelectionIndex.load_or_build(inpath, rebuild=args.rebuildIndex, readOptions=readOptions)
+        for inpath in [args.inpath1, args.inpath2]
+    ]
+
+    if args.eventKey is not None:
+        ievents = [index.find(*args.eventKey) for index in indices]
+        label = ievents[0]
+    elif args.noAlign:
+        ievents = [args.ievent, args.ievent]
+        label = args.ievent
+    else:
+        # Match the events of the two files by run/lumi/event, from the keys in the indices
+        aligner = EventAligner(indices[0].keys, indices[1].keys)
+        write_alignment_report(args.tag, aligner)
+        if not 0 <= args.ievent < len(aligner):
+            raise IndexError(f'Matched event {args.ievent} out of range ({len(aligner)} matched events)')
+        ievents = [aligner.entries0[args.ievent], aligner.entries1[args.ievent]]
+        label = args.ievent
+
+    datas = [
+        read_single_event(inpath, index.entry(ievent), genJetCleaning=False, imageStorage=args.imageStorage, readOptions=readOptions)
+        for inpath, index, ievent in zip([args.inpath1, args.inpath2], indices, ievents)
+    ]
+    return datas, None, 0, label
+
 def make_ratio_plot(args):
-    masked_df1 = RootFile(args.inpath1).get_masked_df()
-    masked_df2 = RootFile(args.inpath2).get_masked_df()
+    readOptions = get_read_options(args)
+    if args.summary:
+        datas, pairs, ievent, eventOffset = load_all_events(args, readOptions)
+    else:
+        datas, pairs, ievent, eventOffset = load_single_event(args, readOptions)
 
     PFTYPES = [
         'all',
@@ -33,13 +102,18 @@ def make_ratio_plot(args):
 
     for pfType in PFTYPES:
         ratioPlotMaker = RatioPlotMaker(
-                [masked_df1, masked_df2],
+                datas,
                 tag=args.tag,
                 pfType=pfType,
-                jetsOnly=False
+                jetsOnly=False,
+                pairs=pairs,
+                eventOffset=eventOffset
                 )
             
-        ratioPlotMaker.make_ratio_plot(args.ievent)
+        ratioPlotMaker.make_ratio_plot(ievent)
+
+        if args.summary:
+            ratioPlotMaker.make_summary_plot()
 
 def main():
     args = parse_cli()
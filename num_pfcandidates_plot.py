@@ -1,24 +1,19 @@
 #!/usr/bin/env python
 
 import os
-import sys
-import re
-import uproot
+import argparse
 import numpy as np
 import mplhep as hep
 
 from matplotlib import pyplot as plt
+from lib.histogrammer import fill_files, save_histograms
+from lib.readoptions import add_read_arguments, get_read_options
 
 pjoin = os.path.join
 
-def plot(tree, dataset_name):
-    data = tree['nPFCands'].array()
-    xedges = np.arange(0,200,5)
-
-    h, _ = np.histogram(data, bins=xedges)
-
+def plot(histogram, dataset_name):
     fig, ax = plt.subplots()
-    hep.histplot(h, xedges, ax=ax)
+    hep.histplot(histogram.counts, histogram.edges, ax=ax)
 
     ax.set_ylabel('Counts')
     ax.set_xlabel('Number of PF Candidates')
@@ -31,16 +26,27 @@ def plot(tree, dataset_name):
     fig.savefig(outpath)
     plt.close(fig)
 
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpaths', nargs='+', help='Paths to the input ROOT files.')
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=100000)
+    parser.add_argument('--workers', type=int, help='Number of worker processes.', default=1)
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
 def main():
-    # Path to input ROOT file
-    inpath = sys.argv[1]
+    args = parse_cli()
+
+    dataset_name = os.path.basename(args.inpaths[0]).replace('nano_','').replace('.root','')
 
-    infile = uproot.open(inpath)
-    tree = infile['Events']
+    specs = [('nPFCands', 'nPFCands', np.arange(0,200,5))]
+    histograms = fill_files(args.inpaths, specs, chunksize=args.chunksize, workers=args.workers, readOptions=get_read_options(args))
 
-    dataset_name = os.path.basename(inpath).replace('nano_','').replace('.root','')
+    # Save the histogram, so that it can be merged with other datasets later
+    save_histograms(pjoin('./output', f'{dataset_name}_num_pf_cands.npz'), histograms)
 
-    plot(tree, dataset_name)
+    plot(histograms['nPFCands'], dataset_name)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
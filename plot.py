@@ -7,15 +7,19 @@ from datetime import datetime
 from tqdm import tqdm
 
 from lib.hasher import MD5Hasher
-from lib.plotmaker import Plot2DMaker
-from lib.rootfile import RootFile
-from lib.genjetcleaner import GenJetCleaner
+from lib.plotmaker import Plot2DMaker, MultiChannelPlotMaker
+from lib.fastrender import FastPlotMaker
+from lib.imagestorage import STORAGE_MODES, get_image_codec
+from lib.memory import MemoryBudget, StageProfiler, parse_size, write_memory_report
+from lib.pipeline import ChunkPrefetcher, iterate_masked_data
+from lib.readoptions import add_read_arguments, get_read_options
+from lib.selectionindex import SelectionIndex, parse_event_key, read_single_event
 
 pjoin = os.path.join
 
 class Job():
     '''Wrapper class to execute the plotting.'''
-    def __init__(self, infile, tag, genJetCleaning=True, pfTypes=['all'], numEvents=5, jetsOnly=False) -> None:
+    def __init__(self, infile, tag, genJetCleaning=True, pfTypes=['all'], numEvents=5, jetsOnly=False, chunksize=10000, prefetchDepth=2, multiChannel=False, imageStorage='float64', fastRender=False, memoryBudget=None, readOptions=None, ievents=None, eventKeys=None) -> None:
         self.infile = infile
         self.tag = tag
         
@@ -26,6 +30,23 @@ class Job():
         self.numEvents = numEvents
         # Event image for jet-based PF candidates, or all PF candidates?
         self.jetsOnly = jetsOnly
+        # Plot all PF types as panels of a single figure per event?
+        self.multiChannel = multiChannel
+        # Write bare PNG images with the fast renderer instead of matplotlib figures?
+        self.fastRender = fastRender
+        # Number of entries read per chunk, and number of chunks prepared ahead
+        self.chunksize = chunksize
+        self.prefetchDepth = prefetchDepth
+        # Storage mode of the image pixels in memory
+        self.imageStorage = imageStorage
+        # Memory budget in bytes, sets the chunk size if specified
+        self.memoryBudget = memoryBudget
+        # Thread pool and basket cache to read the input with
+        self.readOptions = readOptions
+        # Specific events to plot, by post-selection event # or by (run, lumi, event) key.
+        # These are read one by one through the selection index, instead of the whole file.
+        self.ievents = ievents
+        self.eventKeys = eventKeys
 
         # Important: We do NOT have filtered images for jets, 
         # so pfTypes=["all"] if we're looking at jets only
@@ -45,45 +66,133 @@ class Job():
         '''Get the tag name (to rename output dir).'''
         return ''.join(self.infile.split('/')[-2])
 
-    def _make_plot_wrapper(self, masked_data, ievent, pfType):
-        plotMaker = Plot2DMaker(masked_data, 
+    def _make_plots_wrapper(self, masked_data, numEvents, pfType, eventOffset=0):
+        plotMakerClass = FastPlotMaker if self.fastRender else Plot2DMaker
+        plotMaker = plotMakerClass(masked_data, 
             tag=self.tagName, 
             pfType=pfType, 
             jetsOnly=self.jetsOnly,
-            datasetName=self.datasetName
+            datasetName=self.datasetName,
+            eventOffset=eventOffset
             )
         
-        plotMaker.make_plot(ievent)
+        plotMaker.make_plots(0, numEvents)
 
-    def run(self):
-        # Record the MD5 hash of the input file
-        MD5Hasher(self.infile).write_hash_to_file(self.tag)
+    def _make_multichannel_plots_wrapper(self, masked_data, numEvents, eventOffset=0):
+        plotMaker = MultiChannelPlotMaker(masked_data, 
+            tag=self.tagName, 
+            pfTypes=self.pfTypes, 
+            jetsOnly=self.jetsOnly,
+            datasetName=self.datasetName,
+            eventOffset=eventOffset
+            )
         
-        # Get the data (jet candidates + event images) with the VBF cuts applied
-        masked_data = RootFile(self.infile).get_masked_candidates()
-
-        # Only plot the jets that are matching to a GEN-level jet with dR=0.4
-        if self.genJetCleaning:
-            cleaner = GenJetCleaner(masked_data['jets'], masked_data['genJets'])
-            masked_data['jets'] = cleaner.get_clean_jets()
-            masked_data['non_matching_jets'] = cleaner.get_nonmatching_jets()
-
-        # Loop over the events and make an image plot for each
-        for ievent in tqdm(range(min(self.numEvents, len(masked_data['jets'])))):
+        plotMaker.make_plots(0, numEvents)
+
+    def _plot_chunk(self, masked_data, numEvents, eventOffset=0):
+        '''Make the plots for the first numEvents events of a chunk.'''
+        if self.multiChannel and not self.fastRender:
+            self._make_multichannel_plots_wrapper(
+                masked_data, 
+                numEvents=numEvents, 
+                eventOffset=eventOffset,
+                )
+        else:
             for pfType in self.pfTypes:
-                self._make_plot_wrapper(
+                self._make_plots_wrapper(
                     masked_data, 
-                    ievent=ievent, 
+                    numEvents=numEvents, 
                     pfType=pfType, 
+                    eventOffset=eventOffset,
                     )
 
+    def _run_selected_events(self):
+        '''Plot the requested events only, reading just their entries from the input file.'''
+        index = SelectionIndex.load_or_build(self.infile, readOptions=self.readOptions)
+        ievents = list(self.ievents or []) + [index.find(*key) for key in (self.eventKeys or [])]
+
+        for ievent in tqdm(ievents):
+            masked_data = read_single_event(self.infile, 
+                index.entry(ievent), 
+                genJetCleaning=self.genJetCleaning, 
+                imageStorage=self.imageStorage,
+                readOptions=self.readOptions
+                )
+            self._plot_chunk(masked_data, numEvents=1, eventOffset=ievent)
+
+    def run(self):
+        # Record the MD5 hash of the input file
+        MD5Hasher(self.infile).write_hash_to_file(self.tag)
+
+        if self.ievents or self.eventKeys:
+            self._run_selected_events()
+            return
+        
+        # With a memory budget, pick the chunk size so that the chunk being plotted, the one
+        # being read and the prefetched ones all fit, and profile the memory usage of each stage
+        budget = None
+        if self.memoryBudget is not None:
+            budget = MemoryBudget.from_file(self.infile, 
+                self.memoryBudget, 
+                imageCodec=get_image_codec(self.imageStorage), 
+                numChunksInMemory=self.prefetchDepth+2
+                )
+        profiler = StageProfiler(enabled=budget is not None)
+
+        # Get the data (jet candidates + event images) with the VBF cuts applied, chunk by chunk.
+        # The next chunks are read and prepared in a background thread while the current one is plotted.
+        prefetcher = ChunkPrefetcher(
+            iterate_masked_data(self.infile, 
+                chunksize=self.chunksize, 
+                genJetCleaning=self.genJetCleaning, 
+                imageStorage=self.imageStorage,
+                memoryBudget=budget,
+                readOptions=self.readOptions,
+                profiler=profiler
+                ),
+            depth=self.prefetchDepth
+        )
+
+        eventOffset = 0
+        try:
+            with tqdm(total=self.numEvents) as pbar:
+                for masked_data in prefetcher:
+                    # Make an image plot for each event in this chunk
+                    numEventsInChunk = min(self.numEvents - eventOffset, len(masked_data['jets']))
+                    with profiler.stage('plot'):
+                        self._plot_chunk(masked_data, numEventsInChunk, eventOffset=eventOffset)
+                    pbar.update(numEventsInChunk)
+
+                    eventOffset += numEventsInChunk
+                    if eventOffset >= self.numEvents:
+                        break
+        finally:
+            prefetcher.close()
+
+        if profiler.enabled:
+            write_memory_report(self.tag, profiler, budget)
+
 def parse_cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('inpath', help='Path to the input ROOT file.')
     parser.add_argument('--tag', help='The output tag.', default=f'{datetime.now().strftime("%Y-%m-%d")}_run')
     parser.add_argument('--numEvents', help='The number of events to run on.', type=int, default=5)
     parser.add_argument('--jetsOnly', action='store_true', help='Plot jet based images.')
+    parser.add_argument('--multiChannel', action='store_true', help='Plot all PF candidate types as panels of one figure per event.')
+    parser.add_argument('--fastRender', action='store_true', help='Write bare PNG images (no axes, text or legend) with the fast renderer, for bulk dumps.')
+    parser.add_argument('--pfTypes', nargs='+', help='The PF candidate types to plot, by default "all" only (all types with --multiChannel).', default=None)
+    parser.add_argument('--imageStorage', help='Storage mode of the image pixels in memory.', choices=list(STORAGE_MODES), default='float64')
+    parser.add_argument('--memoryBudget', '--memory-budget', help='Memory budget of the job (e.g. 2GB, 500MB), sets the chunk size and writes a memory report. Reading and plotting then run one after the other, to profile them separately.', type=parse_size, default=None)
+    parser.add_argument('--chunksize', help='The number of entries to read per chunk.', type=int, default=10000)
+    parser.add_argument('--prefetchDepth', help='The number of chunks to read ahead in the background.', type=int, default=2)
+    parser.add_argument('--ievent', help='Plot only these (post-selection) event #s, reading just their entries.', type=int, nargs='+', default=None)
+    parser.add_argument('--eventKey', help='Plot only the events with these run:lumi:event keys, reading just their entries.', type=parse_event_key, nargs='+', default=None)
+    add_read_arguments(parser)
     args = parser.parse_args()
+    if args.fastRender and args.multiChannel:
+        parser.error('--fastRender writes one PNG per PF type and cannot be combined with --multiChannel, use --pfTypes instead')
+    if args.memoryBudget is not None and (args.ievent or args.eventKey):
+        parser.error('--ievent and --eventKey read single events without chunking, and cannot be combined with --memoryBudget')
     return args
 
 def main():
@@ -91,20 +200,36 @@ def main():
 
     PFTYPES = [
         'all',
-        # 'NeutralHadron',
-        # 'ChargedHadron',
-        # 'HFEM',
-        # 'HFHadronic',
+        'NeutralHadron',
+        'ChargedHadron',
+        'HFEM',
+        'HFHadronic',
         # 'HighPuppiWeight',
     ]
 
+    if args.pfTypes is not None:
+        pfTypes = args.pfTypes
+    elif args.multiChannel:
+        pfTypes = PFTYPES
+    else:
+        pfTypes = ['all']
+
     # Define the plotting job and run!
     job = Job(
         infile=args.inpath,
         tag=args.tag,
-        pfTypes=PFTYPES,
+        pfTypes=pfTypes,
         numEvents=args.numEvents,
-        jetsOnly=args.jetsOnly
+        jetsOnly=args.jetsOnly,
+        chunksize=args.chunksize,
+        prefetchDepth=args.prefetchDepth,
+        multiChannel=args.multiChannel,
+        imageStorage=args.imageStorage,
+        fastRender=args.fastRender,
+        memoryBudget=args.memoryBudget,
+        readOptions=get_read_options(args),
+        ievents=args.ievent,
+        eventKeys=args.eventKey
     )
 
     job.run()
@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 
 import os
-import sys
 import re
+import argparse
 import uproot
+import awkward
 import numpy as np
 
 from lib.genjetcleaner import GenJetCleaner
+from lib.readoptions import ReadOptions, add_read_arguments, get_read_options
 
 from coffea.analysis_objects import JaggedCandidateArray
 from coffea.processor.dataframe import LazyDataFrame
@@ -15,8 +17,15 @@ from tqdm import tqdm
 
 pjoin = os.path.join
 
+# Branches used for the check, read up front with the read options
+BRANCHES = [
+    'nPFCands', 'PFCands_pt', 'PFCands_eta', 'PFCands_phi', 'PFCands_energy', 'PFCands_px', 'PFCands_py',
+    'nJet', 'Jet_pt', 'Jet_rawFactor', 'Jet_eta', 'Jet_phi',
+    'nGenJet', 'GenJet_pt', 'GenJet_eta', 'GenJet_phi',
+]
+
 class PtChecker():
-    def __init__(self, tree, tag, versiontag=None) -> None:
+    def __init__(self, tree, tag, versiontag=None, readOptions=None) -> None:
         '''
         Calculate the difference between transverse momentum of summed PF candidates within a jet
         and the NanoAOD value for the jet pt.
@@ -24,10 +33,15 @@ class PtChecker():
         self.tree = tree
         self.tag = tag
         self.versiontag = versiontag
+        self.readOptions = readOptions if readOptions is not None else ReadOptions.default()
         self._load_data()
 
     def _load_data(self):
         self.df = LazyDataFrame(self.tree, flatten=True)
+        arrays = self.tree.arrays(BRANCHES, namedecode='utf-8', **self.readOptions.kwargs)
+        for name, array in arrays.items():
+            # Same as what the dataframe returns with flatten=True
+            self.df[name] = array.flatten() if isinstance(array, awkward.JaggedArray) else array
 
     def setup_candidates(self):
         self.pfcands = JaggedCandidateArray.candidatesfromcounts(
@@ -139,8 +153,16 @@ class PtChecker():
         fig.savefig(outpath)
         plt.close(fig)
 
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpath', help='Path to the input ROOT file.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
 def main():
-    inpath = sys.argv[1]
+    args = parse_cli()
+    inpath = args.inpath
     infile = uproot.open(inpath)
     tree = infile['Events']
 
@@ -151,7 +173,7 @@ def main():
     except IndexError:
         versiontag = None
 
-    checker = PtChecker(tree, tag=tag, versiontag=versiontag)
+    checker = PtChecker(tree, tag=tag, versiontag=versiontag, readOptions=get_read_options(args))
     checker.setup_candidates()
 
     numEvents=10
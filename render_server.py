@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import argparse
+
+from lib.imagestorage import STORAGE_MODES
+from lib.memory import parse_size
+from lib.readoptions import add_read_arguments, get_read_options
+from lib.renderserver import RenderService, make_server
+
+def parse_dataset(spec):
+    '''Parse a "name=path" dataset specification.'''
+    name, _, path = spec.partition('=')
+    if not path:
+        raise argparse.ArgumentTypeError(f'Expected name=path, got: {spec}')
+    return name, path
+
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('datasets', nargs='+', type=parse_dataset, help='Datasets to serve, as name=path/to/file.root')
+    parser.add_argument('--port', type=int, help='Port to listen on (localhost only).', default=8050)
+    parser.add_argument('--cacheSize', type=parse_size, help='Size of the cache of rendered images (e.g. 512MB).', default='256MB')
+    parser.add_argument('--numPrefetch', type=int, help='Number of neighbouring events to render ahead on each side.', default=2)
+    parser.add_argument('--imageStorage', help='Storage mode of the image pixels in memory.', choices=list(STORAGE_MODES), default='float32')
+    parser.add_argument('--preload', action='store_true', help='Load all datasets at startup instead of on first request.')
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_cli()
+
+    service = RenderService(dict(args.datasets),
+        cacheBytes=args.cacheSize,
+        numPrefetch=args.numPrefetch,
+        imageStorage=args.imageStorage,
+        readOptions=get_read_options(args)
+        )
+
+    if args.preload:
+        for name, _ in args.datasets:
+            service.get_data(name)
+
+    server = make_server(service, port=args.port)
+    print(f'Serving on http://127.0.0.1:{args.port}')
+    print('Endpoints: /event?dataset=&ievent=&pfType=, /ratio?dataset0=&dataset1=&ievent=&pfType=, /accumulated?dataset=&numevents=&pfType=')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
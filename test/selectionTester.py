@@ -2,26 +2,54 @@
 
 import os
 import sys
-import re
+import argparse
 import uproot
 import numpy as np
 import mplhep as hep
-import pandas as pd
 
 from matplotlib import pyplot as plt
+from matplotlib import colors
 from tqdm import tqdm
 
+# Run from anywhere, with the lib/ package of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.readoptions import add_read_arguments, get_read_options
+
 pjoin = os.path.join
 
 
 class DijetHelper():
-    def __init__(self, df) -> None:
-        self.df = df
+    def __init__(self, arrays) -> None:
+        '''
+        Compute leading/trailing jet variables for events with at least two jets,
+        directly from the flat jet arrays and the jet counts.
+        '''
+        self.arrays = arrays
+        counts = np.asarray(arrays['nJet'])
+        self.mask = counts > 1
+        # Position of the leading jet of each selected event in the flat jet arrays
+        self.leadingIndex = (np.cumsum(counts) - counts)[self.mask]
+
     def get_dijet_variables(self, branchname) -> tuple:
-        v0 = self.df[branchname].apply(lambda x: x[0])
-        v1 = self.df[branchname].apply(lambda x: x[1])
+        content = np.asarray(self.arrays[branchname].flatten())
+        v0 = content[self.leadingIndex]
+        v1 = content[self.leadingIndex + 1]
         return v0, v1
 
+    def get_mjj(self) -> np.ndarray:
+        '''Invariant mass of the leading jet pair.'''
+        pt0, pt1 = self.get_dijet_variables('Jet_pt')
+        eta0, eta1 = self.get_dijet_variables('Jet_eta')
+        phi0, phi1 = self.get_dijet_variables('Jet_phi')
+        mass0, mass1 = self.get_dijet_variables('Jet_mass')
+
+        px = pt0 * np.cos(phi0) + pt1 * np.cos(phi1)
+        py = pt0 * np.sin(phi0) + pt1 * np.sin(phi1)
+        pz = pt0 * np.sinh(eta0) + pt1 * np.sinh(eta1)
+        energy = np.hypot(pt0 * np.cosh(eta0), mass0) + np.hypot(pt1 * np.cosh(eta1), mass1)
+
+        return np.sqrt(np.maximum(energy**2 - px**2 - py**2 - pz**2, 0.))
+
 class PlotSaver():
     def __init__(self, figure) -> None:
         self.outdir = './output'
@@ -37,15 +65,38 @@ class PlotSaver():
 
 class HistogramMaker():
     def __init__(self) -> None:
+        '''Accumulate fixed-binning histograms, chunk by chunk.'''
         self.binnings = {
             'detajj' : np.linspace(0,8,81),
             'dphijj' : np.linspace(0,np.pi),
+            'mjj' : np.arange(0,5000,100),
             'ak4_pt0' : np.arange(0,1000,50),
+            'ak4_pt1' : np.arange(0,1000,50),
+            'ak4_eta0' : np.linspace(-5,5,51),
+            'ak4_eta1' : np.linspace(-5,5,51),
+            'ak4_phi0' : np.linspace(-np.pi,np.pi,51),
+            'ak4_phi1' : np.linspace(-np.pi,np.pi,51),
         }
+        self.histograms = {}
+
     def make_histogram(self, variable, array):
         h, xedges = np.histogram(array, bins=self.binnings[variable])
         return h, xedges
 
+    def fill(self, variable, array):
+        h, _ = self.make_histogram(variable, array)
+        if variable in self.histograms:
+            self.histograms[variable] += h
+        else:
+            self.histograms[variable] = h
+
+    def fill_2d(self, variable, xvariable, xarray, yvariable, yarray):
+        h, _, _ = np.histogram2d(xarray, yarray, bins=(self.binnings[xvariable], self.binnings[yvariable]))
+        if variable in self.histograms:
+            self.histograms[variable] += h
+        else:
+            self.histograms[variable] = h
+
 class PlotMaker():
     def __init__(self, histogram, xedges) -> None:
         self.histogram = histogram
@@ -54,7 +105,13 @@ class PlotMaker():
         self.ylims = {
             'detajj' : (1e-1,1e3),
             'dphijj' : (1e-1,1e3),
+            'mjj' : (1e-1,1e5),
             'ak4_pt0' : (1e-1,1e5),
+            'ak4_pt1' : (1e-1,1e5),
+            'ak4_eta0' : (1e-1,1e5),
+            'ak4_eta1' : (1e-1,1e5),
+            'ak4_phi0' : (1e-1,1e5),
+            'ak4_phi1' : (1e-1,1e5),
         }
 
     def make_plot(self, xlabel, variablename):
@@ -81,18 +138,47 @@ class PlotMaker():
         PlotSaver(fig).save(variablename)
 
 
-def compute_dphi(v0, v1) -> pd.Series:
+def compute_dphi(v0, v1) -> np.ndarray:
     x = np.abs(v0 - v1)
     sign = x <= np.pi
     dphi = sign* x + ~sign * (2*np.pi - x)
     return dphi
 
-def make_ak4_eta0_eta1_plot(df):
+def fill_histograms(histogramMaker, arrays):
+    '''Compute the dijet variables for one chunk and fill the histograms.'''
+    helper = DijetHelper(arrays)
+    ak4_pt0, ak4_pt1 = helper.get_dijet_variables('Jet_pt')
+    ak4_eta0, ak4_eta1 = helper.get_dijet_variables('Jet_eta')
+    ak4_phi0, ak4_phi1 = helper.get_dijet_variables('Jet_phi')
+
+    variables = {
+        'ak4_pt0' : ak4_pt0,
+        'ak4_pt1' : ak4_pt1,
+        'ak4_eta0' : ak4_eta0,
+        'ak4_eta1' : ak4_eta1,
+        'ak4_phi0' : ak4_phi0,
+        'ak4_phi1' : ak4_phi1,
+        'detajj' : np.abs(ak4_eta0 - ak4_eta1),
+        'dphijj' : compute_dphi(ak4_phi0, ak4_phi1),
+        'mjj' : helper.get_mjj(),
+    }
+
+    for variable, array in variables.items():
+        histogramMaker.fill(variable, array)
+
+    histogramMaker.fill_2d('ak4_eta0_eta1', 'ak4_eta0', ak4_eta0, 'ak4_eta1', ak4_eta1)
+
+def make_ak4_eta0_eta1_plot(histogramMaker):
     '''Plot leading jet eta vs trailing jet eta'''
-    ak4_eta0, ak4_eta1 = DijetHelper(df).get_dijet_variables('Jet_eta')
+    xedges = histogramMaker.binnings['ak4_eta0']
+    yedges = histogramMaker.binnings['ak4_eta1']
+    h = histogramMaker.histograms['ak4_eta0_eta1']
 
     fig, ax = plt.subplots()
-    ax.scatter(ak4_eta0, ak4_eta1)
+    cmap = ax.pcolormesh(xedges, yedges, h.T, norm=colors.LogNorm())
+    cb = fig.colorbar(cmap, ax=ax)
+    cb.set_label('Counts')
+
     ax.set_xlim(-5,5)
     ax.set_ylim(-5,5)
 
@@ -101,56 +187,51 @@ def make_ak4_eta0_eta1_plot(df):
 
     PlotSaver(fig).save('ak4_eta0_eta1')
 
-def make_detajj_plot(df):
-    ak4_eta0, ak4_eta1 = DijetHelper(df).get_dijet_variables('Jet_eta')
-
-    detajj = np.abs(ak4_eta0 - ak4_eta1)
-
-    h, xedges = HistogramMaker().make_histogram('detajj', detajj)
-    
-    PlotMaker(h, xedges).make_plot(
-        xlabel=r'$\Delta\eta_{jj}$',
-        variablename='detajj',
-    )
-
-def make_dphijj_plot(df):
-    ak4_phi0, ak4_phi1 = DijetHelper(df).get_dijet_variables('Jet_phi')
-
-    dphijj = compute_dphi(ak4_phi0, ak4_phi1)
-    
-    h, xedges = HistogramMaker().make_histogram('dphijj', dphijj)
-    
-    PlotMaker(h, xedges).make_plot(
-        xlabel=r'$\Delta\phi_{jj}$',
-        variablename='dphijj',
-    )
-
-def make_leading_jet_pt_plot(df):
-    ak4_pt0, _ = DijetHelper(df).get_dijet_variables('Jet_pt')
-    h, xedges = HistogramMaker().make_histogram('ak4_pt0', ak4_pt0)
+def make_1d_plots(histogramMaker):
+    xlabels = {
+        'detajj' : r'$\Delta\eta_{jj}$',
+        'dphijj' : r'$\Delta\phi_{jj}$',
+        'mjj' : r'$M_{jj}$ (GeV)',
+        'ak4_pt0' : r'Leading Jet $p_T$ (GeV)',
+        'ak4_pt1' : r'Trailing Jet $p_T$ (GeV)',
+        'ak4_eta0' : r'Leading Jet $\eta$',
+        'ak4_eta1' : r'Trailing Jet $\eta$',
+        'ak4_phi0' : r'Leading Jet $\phi$',
+        'ak4_phi1' : r'Trailing Jet $\phi$',
+    }
+
+    for variable, xlabel in xlabels.items():
+        PlotMaker(histogramMaker.histograms[variable], histogramMaker.binnings[variable]).make_plot(
+            xlabel=xlabel,
+            variablename=variable,
+        )
 
-    PlotMaker(h, xedges).make_plot(
-        xlabel=r'Leading Jet $p_T$ (GeV)',
-        variablename='ak4_pt0',
-    )
+def parse_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inpaths', nargs='+', help='Paths to the input ROOT files.')
+    parser.add_argument('--chunksize', type=int, help='Number of entries to read per chunk.', default=100000)
+    add_read_arguments(parser)
+    args = parser.parse_args()
+    return args
 
 def main():
-    # Test plots + which function to use
-    TEST_FUNCS = [
-        make_ak4_eta0_eta1_plot,
-        make_detajj_plot,
-        make_dphijj_plot,
-        make_leading_jet_pt_plot,
-    ]
+    args = parse_cli()
 
-    infile = uproot.open( sys.argv[1] )
-    df = infile['Events'].pandas.df(["nJet","Jet*"], flatten=False)
+    histogramMaker = HistogramMaker()
+
+    # Fill the histograms chunk by chunk, over all the input files
+    chunks = uproot.iterate(args.inpaths, 'Events', 
+        ["nJet", "Jet_pt", "Jet_eta", "Jet_phi", "Jet_mass"],
+        entrysteps=args.chunksize,
+        namedecode='utf-8',
+        **get_read_options(args).kwargs
+        )
 
-    # At least two jets!
-    df = df[df["nJet"] > 1]
+    for arrays in tqdm(chunks):
+        fill_histograms(histogramMaker, arrays)
 
-    for func in tqdm(TEST_FUNCS):
-        func(df)
+    make_ak4_eta0_eta1_plot(histogramMaker)
+    make_1d_plots(histogramMaker)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()